@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived acquisition worker for continuous AD5933 sweeps.
+
+Before this, every continuous sweep ran on a new thread that started the next
+one when it finished, and each restart paid Standby, Initialize, and a 1 s
+settling sleep. acquisition_worker runs all sweeps of a driver on one thread,
+takes commands (start, stop, retune, single frequency) from a queue, and
+chains sweeps back-to-back when the sweep registers haven't changed since the
+previous sweep.
+"""
+import queue
+import threading
+
+
+class acquisition_worker():
+    '''
+    Runs continuous sweeps of an ad5933 on a single thread.
+
+    Sweeping is tied to the driver's thread_bool, so clearing it (as the LoS
+    server does) stops the worker at the next status poll just like it
+    stopped the old sweep threads.
+
+    Parameters
+    ----------
+    ad : ad5933
+        driver to sweep with
+    repeat : int, optional
+        maximum number of measurements per frequency (default is 5)
+    init_delay : float, optional
+        settling time in seconds after Initialize when a sweep can't be
+        chained (default is 1.0, as in ad5933.frequency_sweep)
+    chain_delay : float, optional
+        settling time in seconds after Initialize when a sweep is chained to
+        the previous one (default is 0)
+    **sweep_kw
+        passed on to ad5933.frequency_sweep (e.g. sem_threshold)
+    '''
+    # control bits that don't change between sweeps (output range, PGA);
+    # the mode nibble of 0x80 does
+    _CONTROL_SETTINGS = 0b00001111
+    _SWEEPING_MODES = ('Start', 'Increment', 'Repeat')
+
+    def __init__(self, ad, repeat=5, init_delay=1.0, chain_delay=0.0,
+                 **sweep_kw):
+        self.ad = ad
+        self.repeat = repeat
+        self.init_delay = init_delay
+        self.chain_delay = chain_delay
+        self.sweep_kw = sweep_kw
+        self.commands = queue.Queue()
+        # optional callback(data, stats) after every sweep
+        self.on_sweep = None
+        self.sweeps = 0 # completed (or interrupted) sweeps
+        self.chained = 0 # sweeps that skipped re-initialisation
+        self._paused = threading.Event()
+        self._programmed = None # sweep registers at the end of the last sweep
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    @property
+    def paused(self):
+        return self._paused.is_set()
+
+    @property
+    def sweeping(self):
+        return self.ad.thread_bool and not self.paused
+
+    # -- commands ------------------------------------------------------------
+    def start(self):
+        '''start sweeping continuously'''
+        self.commands.put(('start', {}))
+
+    def stop(self, wait=False):
+        '''
+        stop(wait=False)
+
+        Stops sweeping; the current sweep ends at its next status poll. With
+        `wait`, returns once the worker has handled every queued command 
+        (including this one), i.e. when it is no longer using the bus.
+        '''
+        self.ad.thread_bool = False
+        self.commands.put(('stop', {}))
+        if wait and threading.current_thread() is not self._thread \
+                and self.alive:
+            self.commands.join()
+
+    def pause(self):
+        '''hold sweeping without forgetting that it was started'''
+        self._paused.set()
+
+    def resume(self):
+        self._paused.clear()
+        self.commands.put(('resume', {}))
+
+    def retune(self, **params):
+        '''
+        retune(**params)
+
+        Changes driver attributes between sweeps, e.g.
+        retune(start_freq=1000, freq_step=100, num_steps=50).
+        '''
+        self.commands.put(('retune', params))
+
+    def single(self, freq):
+        '''switch to repeated measurements at a single frequency'''
+        self.commands.put(('single', {'freq':freq}))
+
+    def shutdown(self, timeout=None):
+        '''stop sweeping and end the worker thread'''
+        self.ad.thread_bool = False
+        self.commands.put(('shutdown', {}))
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+    # -- worker thread -------------------------------------------------------
+    def _handle(self, name, params):
+        if name == 'start':
+            self.ad.thread_bool = True
+        elif name == 'stop':
+            self.ad.thread_bool = False
+        elif name == 'retune':
+            for key, value in params.items():
+                setattr(self.ad, key, value)
+        elif name == 'single':
+            self.ad.single_frequency_mode(params['freq'])
+
+    def _registers(self):
+        '''the programmed sweep, as far as the register shadow knows it'''
+        shadow = self.ad.register_shadow
+        control = shadow.get(0x80)
+        if control is not None:
+            control &= self._CONTROL_SETTINGS
+        return (control,) + tuple(shadow.get(reg) for reg in range(0x81, 0x8c))
+
+    def _keep_sweeping(self):
+        # a queued command interrupts the sweep so it is handled promptly
+        return self.sweeping and self.commands.empty()
+
+    def _sweep(self):
+        # chaining needs the chip to still be exciting the load with the
+        # same settings, i.e. no Standby, reset, or reprogramming since
+        chained = self.ad.mode in self._SWEEPING_MODES \
+                  and self._programmed == self._registers()
+        data, stats = self.ad.frequency_sweep(
+            self.repeat, verbose=False, return_stats=True,
+            running=self._keep_sweeping, chained=chained,
+            init_delay=self.chain_delay if chained else self.init_delay,
+            **self.sweep_kw)
+        self._programmed = self._registers()
+        self.sweeps += 1
+        self.chained += chained
+        if self.on_sweep is not None:
+            self.on_sweep(data, stats)
+
+    def _run(self):
+        while True:
+            try:
+                # only wait for commands while there is nothing to sweep
+                name, params = self.commands.get(block=not self.sweeping)
+            except queue.Empty:
+                if self.sweeping:
+                    self._sweep()
+                continue
+            try:
+                if name == 'shutdown':
+                    self.ad.thread_bool = False
+                    return
+                self._handle(name, params)
+            finally:
+                self.commands.task_done()
@@ -5,12 +5,25 @@ Created on Thu Jul 11 11:19:02 2019
 @author: joeld
 """
 import time, datetime
+import math
 import warnings
+from collections import deque
 
-import board, busio
-from adafruit_bus_device import i2c_device
-import threading
+try:
+    import board, busio
+    from adafruit_bus_device import i2c_device
+except ImportError:
+    # not on a Pi: an I2C bus has to be passed in (e.g. i2c_sim.sim_bus)
+    board = busio = None
+    import i2c_sim as i2c_device
 import sys
+import numpy as np
+
+from sweep_data import (sweep_buffer, running_stats, CAL_SWEEP_DTYPE, 
+                        STATS_DTYPE, CAL_STATS_DTYPE)
+import sweep_file
+from acquisition import acquisition_worker
+from i2c_tune import tuned_frequency
 
 
 def to_byte_list(integer, n=2):
@@ -21,6 +34,206 @@ def twos_comp(x, bits=16):
         x = x - (1 << bits)          # negate                    
     return x
 
+def encode_freq(freq, mclk):
+    '''24-bit start/increment frequency code (datasheet eq. 1) as 3 bytes'''
+    return to_byte_list((4*freq/mclk)*2**27,n=3)
+
+def encode_settle_cycles(cycles):
+    '''settling time cycles register contents (0x8a-0x8b) as 2 bytes'''
+    # Number of settling cycles is set by a combination of a 9-bit number 
+    # and a multiplication factor of 1, 2, or 4 (encoded in 2 bits).
+    # Why this isn't just an 11-bit number is a mystery...
+    
+    # determine multiplier
+    x2 = 511 < cycles and cycles <= 1022
+    x4 = cycles > 1022
+    
+    # set multiplier code
+    multiplier = 0b11 if x4 else 0b01 if x2 else 0b00
+    
+    # calculate number to write to D8-D0
+    number = cycles//2 if x2 else cycles//4 if x4 else cycles
+    
+    reg8a = multiplier*0b10 + number//0b100000000
+    reg8b = number % 0b100000000
+    return [reg8a, reg8b]
+
+class SweepPlan():
+    '''
+    Precompiled register contents for one sweep configuration.
+    
+    The start frequency, frequency increment, number of increments, and 
+    settling cycles registers (0x82-0x8b) are contiguous, so a plan is a single
+    block of 10 bytes that ad5933.apply_plan writes out. Plans should be
+    obtained through SweepPlan.compile, which caches them by configuration.
+    
+    Parameters
+    ----------
+    mclk : float
+        undivided master clock frequency in Hz
+    divider : int
+        clock divider in use during the sweep
+    start, step : float
+        excitation start frequency and increment in Hz (i.e. after division)
+    count : int
+        number of increments
+    settle : int
+        number of settling cycles
+    '''
+    BASE = 0x82 # _REG3_START_FREQ
+    _cache = {}
+    hits = 0
+    misses = 0
+    
+    def __init__(self, mclk, divider, start, step, count, settle):
+        self.key = (mclk, divider, start, step, count, settle)
+        self.mclk, self.divider = mclk, divider
+        self.start, self.step, self.count, self.settle = start, step, count, settle
+        # the DDS runs from the divided clock, so the programmed frequencies
+        # are the excitation frequencies times the divider
+        self.data = bytes(encode_freq(start*divider, mclk) 
+                          + encode_freq(step*divider, mclk) 
+                          + to_byte_list(count) 
+                          + encode_settle_cycles(settle))
+    
+    @classmethod
+    def compile(cls, mclk, divider, start, step, count, settle):
+        '''cached constructor, see the class documentation for parameters'''
+        key = (mclk, divider, start, step, count, settle)
+        plan = cls._cache.get(key)
+        if plan is None:
+            cls.misses += 1
+            plan = cls._cache[key] = cls(*key)
+        else:
+            cls.hits += 1
+        return plan
+    
+    @classmethod
+    def cache_info(cls):
+        return {'hits':cls.hits, 'misses':cls.misses, 'size':len(cls._cache)}
+    
+    @classmethod
+    def clear_cache(cls):
+        cls._cache.clear()
+        cls.hits = cls.misses = 0
+
+class dft_timer():
+    '''
+    Predicts when an AD5933 DFT conversion will finish and waits for it.
+    
+    After a Start, Increment, or Repeat command the AD5933 excites the load 
+    for the programmed number of settling cycles and then takes 1024 ADC 
+    samples (at MCLK/16) for the DFT. Rather than polling the status register
+    at a fixed interval, the timer sleeps until the predicted completion time
+    and then confirms with short polls. Per-point predicted and actual times
+    are kept so the prediction can be checked against the fixed poll.
+    '''
+    DFT_SAMPLES = 1024
+    ADC_CLOCK_DIV = 16 # the ADC samples at MCLK/16
+    FIXED_POLL = 0.05 # the polling interval this replaces, in seconds
+    
+    def __init__(self, poll_interval=0.002, margin=0.0005, history=4096):
+        self.poll_interval = poll_interval # seconds between confirmation polls
+        self.margin = margin # seconds added to each prediction
+        self.points = deque(maxlen=history) # (predicted, actual, polls)
+        
+    def conversion_time(self, freq, settle_cycles, mclk):
+        '''
+        conversion_time(freq, settle_cycles, mclk)
+        
+        Parameters
+        ----------
+        freq : float
+            excitation frequency in Hz (after any clock division)
+        settle_cycles : int
+            number of output cycles programmed for settling
+        mclk : float
+            master clock frequency in Hz (after any clock division)
+            
+        Returns
+        -------
+        float
+            seconds from the command until the DFT result should be valid
+        '''
+        return settle_cycles/freq + self.DFT_SAMPLES*self.ADC_CLOCK_DIV/mclk
+    
+    def wait(self, ready, start, predicted, running=None):
+        '''
+        wait(ready, start, predicted, running=None)
+        
+        Sleeps until `predicted` seconds after `start` (a time.monotonic()
+        timestamp) and then polls `ready` until it returns True. With
+        `running` the sleep is checked every poll_interval too.
+        
+        Parameters
+        ----------
+        ready : callable
+            returns True once the conversion is complete
+        start : float
+            time.monotonic() when the conversion was started
+        predicted : float
+            predicted conversion time in seconds
+        running : callable, optional
+            waiting is abandoned as soon as this returns False
+            
+        Returns
+        -------
+        bool
+            True if the conversion completed, False if polling was abandoned
+        '''
+        deadline = start + predicted + self.margin
+        if running is None:
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            # in slices, so a long conversion (low frequency, many settling
+            # cycles) can still be abandoned within a poll interval
+            while True:
+                if not running():
+                    return False
+                delay = deadline - time.monotonic()
+                if delay <= 0:
+                    break
+                time.sleep(min(delay, self.poll_interval))
+        polls = 1
+        while not ready():
+            if running is not None and not running():
+                return False
+            time.sleep(self.poll_interval)
+            polls += 1
+        self.points.append((predicted, time.monotonic()-start, polls))
+        return True
+    
+    def clear(self):
+        self.points.clear()
+        
+    def stats(self):
+        '''
+        Summarizes the recorded points.
+        
+        Returns
+        -------
+        dict
+            number of points, mean predicted and actual ready times, mean 
+            prediction error (actual - predicted) and polls per point, and 
+            the mean time saved compared to polling every FIXED_POLL seconds
+        '''
+        n = len(self.points)
+        if n == 0:
+            return {'points':0}
+        predicted = sum(p[0] for p in self.points)/n
+        actual = sum(p[1] for p in self.points)/n
+        polls = sum(p[2] for p in self.points)/n
+        # the fixed poll notices completion at the first multiple of
+        # FIXED_POLL after the conversion is done
+        fixed = sum(math.ceil(p[1]/self.FIXED_POLL)*self.FIXED_POLL 
+                    for p in self.points)/n
+        return {'points':n, 'predicted':predicted, 'actual':actual,
+                'error':actual-predicted, 'polls':polls, 
+                'saved_vs_fixed_poll':fixed-actual}
+
+
 class ad5933():
     '''
     interface to AD5933 impedance converter IC
@@ -37,6 +250,19 @@ class ad5933():
     _REG2_TEMP = 0x92
     _REG2_REAL = 0x94
     _REG2_IMAG = 0x96
+    _WRITABLE = range(0x80, 0x8c) # control through settling cycles
+    
+    # command codes (datasheet Table 12)
+    _CMD_BLOCK_READ = 0b10100001
+    _CMD_ADDRESS_POINTER = 0b10110000
+    
+    # bus cost estimates for sweep planning: bits on the wire of a register
+    # read (address and register, repeated start, address and data, with
+    # acks, start and stop), and transactions per measured point (status 
+    # poll, data read, command write, sweep status) until a sweep has 
+    # measured it
+    TRANSACTION_BITS = 39
+    TRANSACTIONS_PER_POINT = 6
     
     OP_MODES = {  # D15-D12 codes for control register
               'No operation': 0b0000, #also 1000,1100,1101
@@ -60,17 +286,39 @@ class ad5933():
     
     def __init__(self, output_range='200 mVpp', pga_gain=1, mode='Standby',
                  external_clock=True, reset=False, start_freq=10e3,
-                 freq_step=500, num_steps=100, settle_cycles=100, mclk=16e6):
+                 freq_step=500, num_steps=100, settle_cycles=100, mclk=16e6,
+                 block_read=False, i2c=None, calibration=None):
         
         # Clock frequency is 16e6 internally or can be set externally to
         # improve operation at low frequencies
         self.clock_freq = mclk
         
-        # connect through I2C
-        i2c = busio.I2C(board.SCL, board.SDA)
+        # connect through I2C, `i2c` can be any busio.I2C compatible bus
+        if i2c is None:
+            if busio is None:
+                raise RuntimeError('No I2C hardware available, pass in a bus '
+                                   '(e.g. i2c_sim.sim_bus) as `i2c`')
+            # the clock found by i2c_tune for this board, if it was tuned
+            i2c = busio.I2C(board.SCL, board.SDA, 
+                            frequency=tuned_frequency(default=100000))
         self.i2c = i2c_device.I2CDevice(i2c, self.ADDR)
         self._buffer = bytearray(2) #used for I2C read/write   
         
+        # write-through copy of the writable registers (0x80-0x8b) so that
+        # read-modify-writes of the control register don't need a bus read
+        self._shadow = {}
+        self.bus_transactions = 0 # count of I2C transactions on this device
+        self.transactions_per_point = None # measured by frequency_sweep
+        self._pointer = None # register the address pointer is known to hold
+        self.block_read = False
+        self._only_changed = False # skip writes the shadow shows are no-ops
+        
+        # configuration that soft_reset returns to
+        self._config = {'output_range':output_range, 'pga_gain':pga_gain,
+                        'external_clock':external_clock, 'mode':mode,
+                        'start_freq':start_freq, 'freq_step':freq_step,
+                        'num_steps':num_steps, 'settle_cycles':settle_cycles}
+        
         # class attributes reflect all of the writable registers in the AD5933
         self.output_range = output_range
         self.pga_gain = pga_gain
@@ -82,12 +330,24 @@ class ad5933():
         self.num_steps = num_steps
         self.settle_cycles = settle_cycles
         
-        self.curr_f = 0
-        self.curr_r = 0
-        self.curr_i = 0
+        # points of the current (or last) sweep, curr_t/f/r/i read from here
+        self.sweep_data = sweep_buffer(0)
+        # per-frequency mean, std, and number of repeats of the same sweep
+        self.sweep_stats = sweep_buffer(0, STATS_DTYPE)
+        # optional per-point hook, e.g. sweep_data.point_reporter()
+        self.reporter = None
+        # optional calibration.calibration_table, sweeps then also record 
+        # |Z| and phase (fields M and P)
+        self.calibration = calibration
+        
+        # block reads are only used if they agree with the byte-wise path
+        if block_read:
+            self.block_read = self.verify_block_read()
 
+        self.timer = dft_timer() # schedules status polls during sweeps
+        
         self.thread_bool = False
-        self.frequency_sweep_thread = threading.Thread(target=self.frequency_sweep, args=())
+        self.worker = None # acquisition_worker, created by start_thread
         
         
         # In addition, the AD5933 has readable registers for status, 
@@ -100,8 +360,45 @@ class ad5933():
         self.deinit()
         
     def deinit(self):
+        if self.worker is not None:
+            self.worker.shutdown()
         self.i2c.i2c.deinit()
         
+    def _latest(self, field):
+        point = self.sweep_data.latest()
+        if point is None or field not in point.dtype.names:
+            return 0
+        return point[field]
+    
+    @property
+    def curr_t(self):
+        '''time of the most recent point (relative to the sweep start)'''
+        return self._latest('T')
+    @property
+    def curr_f(self):
+        '''frequency of the most recent point'''
+        return self._latest('F')
+    @property
+    def curr_r(self):
+        '''real part of the most recent point'''
+        return self._latest('R')
+    @property
+    def curr_i(self):
+        '''imaginary part of the most recent point'''
+        return self._latest('I')
+    @property
+    def curr_m(self):
+        '''calibrated |Z| of the most recent point (0 if uncalibrated)'''
+        return self._latest('M')
+    @property
+    def curr_p(self):
+        '''calibrated phase of the most recent point (0 if uncalibrated)'''
+        return self._latest('P')
+    @property
+    def calibrated(self):
+        '''True if the current sweep data includes |Z| and phase'''
+        return 'M' in self.sweep_data.dtype.names
+        
     @property
     def output_range(self):
         return self.__output_range
@@ -207,27 +504,31 @@ class ad5933():
     def _write_mode(self): # D12-D15
         '''Shortcut to change only the mode in the control register.'''
         code = self.OP_MODES[self.mode]
-        current = self.read_register(self._REG2_CONTROL) # read only 0x80
+        current = self.read_shadow(self._REG2_CONTROL) # only 0x80
         new = code*0b10000 + (current & 0b00001111) # keep 4 LSBs the same
         self.write_register(self._REG2_CONTROL, [new])
         
     def _write_pga(self):
         pga_bit = 1 if self.pga_gain == 1 else 0 # D8: x1 -> 1, x5 -> 0
-        current = self.read_register(self._REG2_CONTROL) # read only 0x80
+        current = self.read_shadow(self._REG2_CONTROL) # only 0x80
         new = pga_bit + (current & 0b11111110)
         self.write_register(self._REG2_CONTROL, [new])
         
-    def _write_reset(self):
-        rst_bit = int(self.reset) # D4
-        current = self.read_register(self._REG2_CONTROL, 2)
-        new = rst_bit*0b0000000000010000 + (current & 0b1111111111101111)
-        self.write_register(self._REG2_CONTROL, to_byte_list(new))
+    def _write_reset(self): # D4 (bit 4 of 0x81)
+        rst_bit = int(self.reset)
+        current = self.read_shadow(self._REG2_CONTROL+1) # only 0x81
+        new = rst_bit*0b00010000 + (current & 0b11101111)
+        self.write_register(self._REG2_CONTROL+1, [new])
+        if self.reset:
+            # the chip drops out of its sweep on reset, so nothing cached
+            # about it can be trusted anymore
+            self.invalidate_shadow()
 
-    def _write_external_clock(self): # D3
+    def _write_external_clock(self): # D3 (bit 3 of 0x81)
         clk_bit = int(self.external_clock) # D3: external -> 1, internal -> 0
-        current = self.read_register(self._REG2_CONTROL, 2)
-        new = clk_bit*0b0000000000001000 + (current & 0b1111111111110111)
-        self.write_register(self._REG2_CONTROL, to_byte_list(new))
+        current = self.read_shadow(self._REG2_CONTROL+1) # only 0x81
+        new = clk_bit*0b00001000 + (current & 0b11110111)
+        self.write_register(self._REG2_CONTROL+1, [new])
         
     def _write_output_range(self): # D9-D10
         src_range = {       # D10-D9
@@ -236,7 +537,7 @@ class ad5933():
                     3:0b10, # 400 mVpp
                     2:0b11, # 1 Vpp
                     }
-        current = self.read_register(self._REG2_CONTROL) # read only 0x80
+        current = self.read_shadow(self._REG2_CONTROL) # only 0x80
         new = src_range[self.output_range]*0b10+(current & 0b11111001)
         self.write_register(self._REG2_CONTROL, [new])
         
@@ -263,43 +564,38 @@ class ad5933():
         
     #     self.write_register(self._REG2_CONTROL, [reg80, reg81])
     
-    # def write_sweep_params(self):
-    #     '''
-    #     write_sweep_params(mclk=16e6)
-        
-    #     Encodes and writes the start_freq, freq_step, and num_steps attributes 
-    #     into the AD5933 chip's registers
-        
-    #     Parameters
-    #     ----------
-    #     mclk : float, optional
-    #         master clock frequency in Hz, default is 16e6
-    #     '''
-    #     mclk = self.clock_freq
-        
-    #     start_code = to_byte_list((4*self.start_freq/mclk)*2**27,n=3)
-    #     incr_code  = to_byte_list((4*self.freq_step/mclk)*2**27,n=3)
-    #     num_code   = to_byte_list(self.num_steps)
+    def write_sweep_params(self):
+        '''
+        write_sweep_params()
         
+        Encodes and writes the start_freq, freq_step, num_steps, and 
+        settle_cycles attributes into the AD5933 chip's registers
+        '''
+        self._write_start_freq()
+        self._write_incr_freq()
+        self._write_num_increments()
+        self._write_settling_intervals()
         
-    #     self.write_register(self._REG3_START_FREQ, start_code)
-    #     self.write_register(self._REG3_INCR_FREQ, incr_code)
-    #     self.write_register(self._REG2_NUM_INCR, num_code)
+    def initialize(self):
+        '''
+        Puts the AD5933 in standby with the current sweep parameters written,
+        ready for frequency_sweep.
+        '''
+        self.mode = 'Standby'
+        self.write_sweep_params()
     
     def _write_start_freq(self):
         '''
         write starting frequency to register
         '''
-        mclk = self.clock_freq
-        start_code = to_byte_list((4*self.start_freq/mclk)*2**27,n=3)
+        start_code = encode_freq(self.start_freq, self.clock_freq)
         self.write_register(self._REG3_START_FREQ, start_code)
     
     def _write_incr_freq(self):
         '''
         write frequency step to register
         '''
-        mclk = self.clock_freq
-        incr_code  = to_byte_list((4*self.freq_step/mclk)*2**27,n=3)
+        incr_code  = encode_freq(self.freq_step, self.clock_freq)
         self.write_register(self._REG3_INCR_FREQ, incr_code)
     
     def _write_num_increments(self):
@@ -310,33 +606,72 @@ class ad5933():
         self.write_register(self._REG2_NUM_INCR, num_code)
     
     def _write_settling_intervals(self):
-        # Number of settling cycles is set by a combination of a 9-bit number 
-        # and a multiplication factor of 1, 2, or 4 (encoded in 2 bits).
-        # Why this isn't just an 11-bit number is a mystery...
-        
-        # determine multiplier
-        x2 = 511 < self.settle_cycles and self.settle_cycles <= 1022
-        x4 = self.settle_cycles > 1022
+        settle_code = encode_settle_cycles(self.settle_cycles)
+        self.write_register(self._REG2_SETTLE_CYCLES, settle_code)
         
-        # set multiplier code
-        multiplier = 0b11 if x4 else 0b01 if x2 else 0b00
-        
-        # calculate number to write to D8-D0
-        number = self.settle_cycles
-        number = number//2 if x2 else number//4 if x4 else number
+    def apply_plan(self, plan):
+        '''
+        apply_plan(plan)
         
-        reg8a = multiplier*0b10 + number//0b100000000
-        reg8b = number % 0b100000000
- 
-        self.write_register(self._REG2_SETTLE_CYCLES, [reg8a, reg8b])
+        Writes a SweepPlan's precomputed registers and updates start_freq,
+        freq_step, num_steps, and settle_cycles to match. Bytes that the
+        register shadow shows are already programmed are skipped.
+        '''
+        if plan.mclk != self.clock_freq:
+            raise ValueError('SweepPlan was compiled for a {} Hz clock, not {}'
+                             ' Hz'.format(plan.mclk, self.clock_freq))
+        for i, val in enumerate(plan.data):
+            reg = plan.BASE + i
+            if self._shadow.get(reg) != val:
+                self.write_register(reg, [val])
+        self.__start_freq = plan.start*plan.divider
+        self.__freq_step = plan.step*plan.divider
+        self.__num_steps = plan.count
+        self.__settle_cycles = plan.settle
         
+    def transaction_time(self):
+        '''estimated seconds per I2C transaction at the bus clock'''
+        frequency = getattr(self.i2c.i2c, 'frequency', None) or 100000
+        return self.TRANSACTION_BITS/frequency
+    
+    def point_overhead(self):
+        '''
+        Estimated seconds of bus traffic per measured point: the transactions
+        per point of the last sweep (TRANSACTIONS_PER_POINT before the first)
+        at transaction_time each.
+        '''
+        per_point = self.transactions_per_point or self.TRANSACTIONS_PER_POINT
+        return per_point*self.transaction_time()
+    
     def read_status(self):
         '''read status register'''
         return self.read_register(self._REG1_STATUS)
         
+    def read_shadow(self, reg):
+        '''
+        read_shadow(reg)
+        
+        Returns the last value written to writable register `reg`. The
+        register is only read over I2C if it hasn't been written (or read)
+        since the shadow was last invalidated.
+        '''
+        if reg not in self._shadow:
+            self._shadow[reg] = self.read_register(reg)
+        return self._shadow[reg]
+    
+    def invalidate_shadow(self):
+        '''forget the cached register values, forcing a re-read on next use'''
+        self._shadow.clear()
+    
+    @property
+    def register_shadow(self):
+        '''copy of the cached writable registers as {address: byte}'''
+        return dict(self._shadow)
+        
     def read_register(self, reg, bytes_to_read=1):
         ''' block reading doesn't seem to work properly, so all read/writes
-        operate 1 byte at a time'''
+        operate 1 byte at a time (see read_block for the verified fast path).
+        Multi-byte registers are MSB first.'''
         # buffer = bytearray(bytes_to_read+1) # for efficiency class could have a single buffer (with fixed size) instead
         # with self.i2c as dev:
         #     buffer[0] = reg
@@ -350,17 +685,91 @@ class ad5933():
                 self._buffer[0] = reg+i
                 dev.write_then_readinto(self._buffer, self._buffer, out_end=1, in_start=1, 
                                         in_end=2)
-                result += self._buffer[1] * 2**i
+                self.bus_transactions += 1
+                if reg+i in self._WRITABLE:
+                    self._shadow[reg+i] = self._buffer[1]
+                result = (result << 8) + self._buffer[1]
+        if bytes_to_read:
+            # each register address write moves the address pointer
+            self._pointer = reg + bytes_to_read - 1
         return result
+    
+    def read_block(self, reg, bytes_to_read):
+        '''
+        read_block(reg, bytes_to_read)
+        
+        Reads `bytes_to_read` consecutive registers starting at `reg` with the
+        AD5933 block read command. The address pointer is only reprogrammed
+        when it doesn't already hold `reg`, so back to back reads of the same
+        block cost a single I2C transaction. Byte-wise reads and writes leave
+        the pointer on the last register they addressed (which is tracked), so
+        in a sweep, where the status and control registers are accessed 
+        between data reads, a block read of the data registers costs two 
+        transactions instead of four.
+        
+        Returns
+        -------
+        bytearray
+            the register contents, in address order
+        '''
+        result = bytearray(bytes_to_read)
+        with self.i2c as dev:
+            if self._pointer != reg:
+                dev.write(bytes([self._CMD_ADDRESS_POINTER, reg]))
+                self.bus_transactions += 1
+                self._pointer = reg
+            dev.write_then_readinto(bytes([self._CMD_BLOCK_READ, bytes_to_read]),
+                                    result)
+            self.bus_transactions += 1
+        return result
+    
+    def verify_block_read(self, trials=2):
+        '''
+        verify_block_read(trials=2)
+        
+        Compares block reads of the sweep parameter and data registers against
+        the byte-wise path. The block read is repeated `trials` times so that
+        reuse of the address pointer is checked as well.
+        
+        Returns
+        -------
+        bool
+            True if every block read matched, False otherwise (including if 
+            the block read raised an I/O error)
+        '''
+        blocks = ((self._REG3_START_FREQ, 10), (self._REG2_REAL, 4))
+        try:
+            for reg, n in blocks:
+                expected = self.read_register(reg, n).to_bytes(n, 'big')
+                for _ in range(trials):
+                    if bytes(self.read_block(reg, n)) != expected:
+                        raise ValueError('block read mismatch at '+hex(reg))
+        except (OSError, ValueError) as e:
+            warnings.warn('Block read disabled, falling back to byte-wise '
+                          'reads ({})'.format(e))
+            self._pointer = None
+            return False
+        return True
         
     def write_register(self, reg, val_array):
         '''block writing doesn't seem to work properly, so all read/writes
         operate 1 byte at a time'''
+        writes = [(reg+i, val & 0xff) # limit val to 256 to prevent ValueErrors
+                  for i, val in enumerate(val_array)]
+        if self._only_changed:
+            # (any unknown registers are read before the bus is locked)
+            writes = [(r, val) for r, val in writes 
+                      if self.read_shadow(r) != val]
         with self.i2c as dev:
-            for i, val in enumerate(val_array):
-                self._buffer[0] = reg+i
-                self._buffer[1] = val & 0xff # limit val to 256 to prevent ValueErrors
+            for r, val in writes:
+                self._buffer[0] = r
+                self._buffer[1] = val
                 dev.write(self._buffer)
+                self.bus_transactions += 1
+                if r in self._WRITABLE:
+                    self._shadow[r] = val
+        if writes:
+            self._pointer = writes[-1][0]
             
     def data_ready(self):
         ''' 
@@ -391,98 +800,235 @@ class ad5933():
     def get_data(self):
         '''data stored in read only 16-bit two's complement'''
         
-        real = self.read_register(self._REG2_REAL, 2)
-        imag = self.read_register(self._REG2_IMAG, 2)
-        
-        self.curr_r = twos_comp(real)
-        self.curr_i = twos_comp(imag)
+        if self.block_read:
+            raw = self.read_block(self._REG2_REAL, 4) # real and imag together
+            real = int.from_bytes(raw[:2], 'big')
+            imag = int.from_bytes(raw[2:], 'big')
+        else:
+            real = self.read_register(self._REG2_REAL, 2)
+            imag = self.read_register(self._REG2_IMAG, 2)
         
         return [twos_comp(real), twos_comp(imag)]
     
-    def start_thread(self):
-        # self.frequency_sweep_thread.join()
-        self.thread_bool == True
-        self.frequency_sweep_thread = threading.Thread(target=self.frequency_sweep, args=())
-        self.frequency_sweep_thread.start()
+    def start_thread(self, **worker_kw):
+        '''
+        start_thread(**worker_kw)
+        
+        Starts continuous sweeps on the acquisition worker (see 
+        acquisition.acquisition_worker, which `worker_kw` is passed to), 
+        creating it on first use. Clearing thread_bool or calling stop_thread 
+        stops them again.
+        '''
+        if self.worker is None or not self.worker.alive:
+            self.worker = acquisition_worker(self, **worker_kw)
+        self.thread_bool = True
+        self.worker.start()
+        
+    def stop_thread(self, wait=True):
+        '''
+        stop_thread(wait=True)
+        
+        Stops continuous sweeps. With `wait`, returns once the worker has
+        left the sweep, so the bus is free for other commands.
+        '''
+        self.thread_bool = False
+        if self.worker is not None:
+            self.worker.stop(wait=wait)
+            
+    def soft_reset(self, verify=False, **settings):
+        '''
+        soft_reset(verify=False, **settings)
+        
+        Returns the driver to the configuration it was constructed with 
+        (updated with `settings`, keyword arguments as for the constructor)
+        without reopening the bus. Continuous sweeps are stopped, the chip is
+        put back in the configured mode, and only registers whose shadowed 
+        contents differ from the configuration are written.
+        
+        Parameters
+        ----------
+        verify : bool, optional
+            re-read the writable registers first instead of trusting the
+            shadow, e.g. if the chip may have been power cycled (default is
+            False)
+        '''
+        self.stop_thread()
+        if verify:
+            self.invalidate_shadow()
+        config = dict(self._config, **settings)
+        self._only_changed = True
+        try:
+            for name in ('output_range', 'pga_gain', 'external_clock', 'mode',
+                         'start_freq', 'freq_step', 'num_steps', 
+                         'settle_cycles'):
+                setattr(self, name, config[name])
+            self.reset = False
+        finally:
+            self._only_changed = False
+        self.sweep_data = sweep_buffer(0)
+        self.sweep_stats = sweep_buffer(0, STATS_DTYPE)
     
     def frequency_sweep(self, repeat=5, delay=0, verbose=True,
-                        freq_reporting_factor=None):
-        # Place the AD5933 into standby mode
-        self.mode = 'Standby'
-        # Program initialize with start frequency command to the control register
-        self.mode = 'Initialize'
-        if verbose: print('Initializing...')
-        # After sufficient amount of settling time, program start frequency 
-        # sweep command in the control register
-        time.sleep(1)
-        if verbose: print('Beginning Sweep...')
-        self.mode = 'Start'
+                        freq_reporting_factor=None, min_repeat=3, sem_threshold=None, return_stats=False,
+                        running=None, chained=False, init_delay=1.0):
+        '''
+        Runs the programmed sweep and returns its points as a structured 
+        (T,F,R,I) array, or (T,F,R,I,M,P) if a calibration table is set. 
+        `running`, if given, is polled and the sweep stops when it returns 
+        False. Continuous sweeps are run by the acquisition worker (see 
+        start_thread).
+        
+        The sweep starts with Standby, Initialize, `init_delay` seconds of
+        settling, and Start. With `chained` (the chip is still excited with 
+        this sweep's settings from the previous one) Standby is skipped, and 
+        in single frequency mode the measurement is simply repeated.
+        
+        The repeats at each frequency are summarised as they arrive (see
+        sweep_stats). With `sem_threshold`, a frequency is repeated at least 
+        `min_repeat` and at most `repeat` times, stopping as soon as the 
+        standard errors of the real and imaginary means are both at or below
+        `sem_threshold` (in DFT counts). Without it every frequency is 
+        repeated `repeat` times.
+        
+        With `return_stats`, returns (points, stats) where stats has one
+        (T,F,R,I,SR,SI,N) record per frequency: mean time, frequency, mean
+        real and imaginary, their standard deviations, and the number of
+        repeats (plus M,P from the means if calibrated).
+        '''
+        if running is None:
+            running = lambda: True
+        if chained and self.num_steps == 0:
+            # still at the frequency, keep measuring it
+            self.mode = 'Repeat'
+        else:
+            # Place the AD5933 into standby mode
+            if not chained:
+                self.mode = 'Standby'
+            # Program initialize with start frequency command to the control register
+            self.mode = 'Initialize'
+            if verbose: print('Initializing...')
+            # After sufficient amount of settling time, program start frequency 
+            # sweep command in the control register
+            settled = time.monotonic() + init_delay
+            while running() and time.monotonic() < settled:
+                time.sleep(max(0, min(settled - time.monotonic(), 0.05)))
+            if verbose: print('Beginning Sweep...')
+            self.mode = 'Start'
+        issued = time.monotonic() # when the current conversion was started
         # main loop
-        data = []
         n = 1 # repeat counter
+        k = 0 # increment counter
         f = self.start_freq
+        # clock division slows both the DDS output and the ADC
+        factor = 1 if freq_reporting_factor is None else freq_reporting_factor
+        cal = self.calibration
+        if cal is None:
+            data = sweep_buffer((self.num_steps+1)*repeat)
+            stats = sweep_buffer(self.num_steps+1, STATS_DTYPE)
+        else:
+            data = sweep_buffer((self.num_steps+1)*repeat, CAL_SWEEP_DTYPE)
+            stats = sweep_buffer(self.num_steps+1, CAL_STATS_DTYPE)
+            # gain factor and system phase at every point of this sweep, so
+            # each point only costs a multiply and a subtraction
+            swept = self.start_freq + self.freq_step*np.arange(self.num_steps+1)
+            gains, phases = cal.interpolate(swept/factor)
+        def calibrate(k, real, imag):
+            m = math.hypot(real, imag)
+            return (1/(gains[k]*m) if m else math.inf, 
+                    math.atan2(imag, real) - phases[k])
+        def summarise(k, f):
+            if cal is None:
+                stats.append(*stat.record(f))
+            else:
+                stats.append(*stat.record(f), 
+                             *calibrate(k, stat.real, stat.imag))
+            stat.clear()
+        stat = running_stats()
+        self.sweep_stats = stats
         timestamp = datetime.datetime.now()
+        self.timer.clear()
+        transactions = self.bus_transactions
         
-        while self.thread_bool:
+        while running():
             if delay != 0:
                 time.sleep(delay)
-            # Poll status register to check if DFT conversion is complete
-            while not self.data_ready() and self.thread_bool:
-                time.sleep(0.05)
+            # Wait until the DFT conversion should be complete, then confirm
+            # it with the status register
+            predicted = self.timer.conversion_time(f/factor, self.settle_cycles,
+                                                   self.clock_freq/factor)
+            if not self.timer.wait(self.data_ready, issued, predicted,
+                                   running=running):
+                break
             # Read values from real and imaginary data register
             # if verbose: print('Frequency: {}'.format(f))
             t = (datetime.datetime.now() - timestamp).total_seconds()
-            self.curr_t = t
-
-            if freq_reporting_factor is None:
-                data.append([t,f]+self.get_data()) # alternately could write to file here
-                self.curr_f = f
-            else: #used if clock division is active
-                data.append([t,f/freq_reporting_factor]+self.get_data())
-                self.curr_f = f/freq_reporting_factor                
-            
-            print(f"{self.curr_t}, {self.curr_f}, {self.curr_r}, {self.curr_i}")
+            # factor is only used if clock division is active
+            real, imag = self.get_data()
+            if cal is None:
+                data.append(t, f/factor, real, imag)
+            else:
+                data.append(t, f/factor, real, imag, *calibrate(k, real, imag))
+            stat.add(t, real, imag)
+            if len(data) == 1:
+                # publish the new buffer once it has a point, so that curr_*
+                # keep the previous sweep's last point in the meantime
+                self.sweep_data = data
+            if self.reporter is not None:
+                self.reporter(*data.latest())
             
             # Program the increment or repeat frequency command to the
             # control register
-            if n < repeat:
+            converged = (sem_threshold is not None and n >= min_repeat 
+                         and stat.sem() <= sem_threshold)
+            if n < repeat and not converged:
                 self.mode = 'Repeat'
+                issued = time.monotonic()
                 n += 1
             else:
+                summarise(k, f/factor)
                 # Poll status register to check if frequency sweep is 
                 # complete (or end sweep in single frequency mode
-                if self.sweep_complete() or self.num_steps == 0 or self.thread_bool == False:
+                if self.sweep_complete() or self.num_steps == 0 or not running():
                     break
                 # Otherwise increment frequency
                 self.mode = 'Increment'
+                issued = time.monotonic()
                 n = 1
+                k = min(k+1, self.num_steps)
                 f += self.freq_step
         
-        self.should_restart_sweep()
+        if stat.n: # stopped part way through a frequency
+            summarise(k, f/factor)
+        if len(data):
+            self.transactions_per_point = (self.bus_transactions - 
+                                           transactions)/len(data)
+        if return_stats:
+            return data.data, stats.data
+        return data.data
                         
         # Program the AD5933 into power-down mode
         # self.mode = 'Power-down'
         # if verbose: print('Sweep complete.')
         # return data
-        
-    def should_restart_sweep(self):
-        if self.thread_bool:
-            self.start_thread()
-        else:
-            return
+    
+    def file_metadata(self):
+        '''settings to record with sweep data (see sweep_file)'''
+        return {'output range':self.output_range, 'pga_gain':self.pga_gain,
+                'external_clock':self.external_clock, 
+                'settle_cycles':self.settle_cycles, 
+                'code version':self.__version__, 
+                'timestamp':str(datetime.datetime.now()),
+                'clock_freq':self.clock_freq}
     
     def write_data_to_file(self, data, filename):
-        var_list = [self.output_range, self.pga_gain, self.external_clock, 
-            self.settle_cycles, self.__version__, str(datetime.datetime.now())]
-        metadata = ('output range: {}, pga_gain: {}, external_clock: {}, '
-        'settle_cycles: {}, code version: {}, timestamp: {}').format(*var_list)
-        with open(filename,'w') as f:
-            f.write(metadata)
-            f.write('\n\n')
-            f.write('T,F,R,I\n')            
-            for d in data:
-                line = ','.join(['{}'.format(x) for x in d]) + '\n'
-                f.write(line)
+        '''
+        write_data_to_file(data, filename)
+        
+        Writes sweep data with the current settings as metadata. Files ending
+        in sweep_file.EXTENSION (.eisb) are written in the binary sweep file 
+        format, anything else in the T,F,R,I text format.
+        '''
+        sweep_file.save(filename, data, self.file_metadata())
                 
     def single_frequency_mode(self, freq):
         '''
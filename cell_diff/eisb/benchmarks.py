@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Acquisition benchmarks on the simulated I2C bus.
+
+Runs the main acquisition paths against i2c_sim (with a fixed latency per
+transaction standing in for bus time) and reports for each:
+
+    time per sweep (wall time), I2C transactions per point, the jitter of
+    the periodic scheduler (for the timed benchmarks), and peak Python
+    memory (tracemalloc, measured in a separate untimed run)
+
+Results are written as JSON, so runs of different versions can be compared:
+
+    python3 benchmarks.py -o v2.01.json
+    python3 benchmarks.py -o new.json --baseline v2.01.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from ad5933 import ad5933
+from eis_board import eis_board
+from i2c_sim import sim_bus, sim_ad5933, rc_load
+from thread_timing import timed_execution
+import eis_board as eis_board_module
+import sweep_file
+
+# a 2 byte register write at 100 kHz takes about 0.3 ms
+LATENCY = 300e-6
+# keys compared by compare(), larger is worse for all of them, with the 
+# smallest change that counts (jitter of a few ms is scheduling noise)
+COMPARED = {'sweep_time':0.0, 'transactions_per_point':0.0,
+            'jitter_max':5e-3, 'peak_memory':0}
+
+
+def sim_board(latency=LATENCY, load=None, noise=0.0):
+    '''
+    eis_board with one simulated AD5933 on a sim_bus with `latency` seconds
+    per transaction, returns (board, bus)
+    '''
+    bus = sim_bus(latency=latency)
+    load = rc_load(100e3, 1e-9) if load is None else load
+    sim = bus.attach(ad5933.ADDR, sim_ad5933(load, noise=noise))
+    board = eis_board(ad_kw={'i2c':bus})
+    # the board's (simulated) clock divider slows the emulated chip down
+    sim.clock_divider = lambda: board.rpi.clock_divide
+    return board, bus
+
+
+def measure(bus, func, rounds=1, memory=True):
+    '''
+    Calls `func()` `rounds` times and summarises them.
+
+    `func` returns the number of points it acquired and optionally a dict of
+    extra results (e.g. scheduler statistics), which is merged into the
+    summary of the last round.
+
+    Returns
+    -------
+    dict
+        sweep_time (mean wall time per call), sweep_time_min, points,
+        transactions_per_point and, with `memory`, the peak_memory in bytes
+        traced during one more call
+    '''
+    times = []
+    transactions = points = 0
+    extra = {}
+    for _ in range(rounds):
+        before = bus.transactions
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+        transactions += bus.transactions - before
+        if isinstance(result, tuple):
+            result, extra = result
+        points += result
+    summary = {'rounds':rounds, 'sweep_time':float(np.mean(times)),
+               'sweep_time_min':min(times), 'points':points//rounds,
+               'transactions_per_point':transactions/max(points, 1)}
+    summary.update(extra)
+    if memory:
+        # tracing slows Python down, so this run isn't timed
+        tracemalloc.start()
+        try:
+            func()
+            summary['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return summary
+
+
+def bench_frequency_sweep(board, bus, repeat=5, num_steps=50,
+                          start_freq=10e3, freq_step=1e3, **kw):
+    '''the programmed linear sweep, ad5933.frequency_sweep'''
+    ad = board.ad
+    ad.start_freq = start_freq
+    ad.freq_step = freq_step
+    ad.num_steps = num_steps
+    sweep = lambda: len(ad.frequency_sweep(repeat=repeat, verbose=False))
+    return measure(bus, sweep, **kw)
+
+
+def bench_full_range(board, bus, repeat=5, num_steps=50, **kw):
+    '''the log-spaced 1-100 kHz sweep, eis_board.freq_sweep_full_range'''
+    sweep = lambda: len(board.freq_sweep_full_range(0, repeat=repeat,
+                                                    num_steps=num_steps))
+    return measure(bus, sweep, **kw)
+
+
+def bench_continuous(board, bus, repeat=5, num_sweeps=3, Ts=None, **kw):
+    '''
+    eis_board.save_continuous_sweeps of `num_sweeps` full range sweeps into a
+    temporary directory, `Ts` apart (default is 1.5 times the time it takes
+    to save one)
+    '''
+    def run():
+        with tempfile.TemporaryDirectory() as dest:
+            name = os.path.join(dest, 'bench')
+            period = Ts
+            if period is None:
+                started = time.perf_counter()
+                board.save_full_range_sweep(name, ch=[0], repeat=repeat)
+                board.writer.flush()
+                period = 1.5*(time.perf_counter() - started)
+                os.remove(os.path.join(dest, os.listdir(dest)[0]))
+            before = bus.transactions
+            stats = board.save_continuous_sweeps(name, repeat=repeat, 
+                                                 Ts=period, ch=[0],
+                                                 num_sweeps=num_sweeps)
+            stats['transactions'] = bus.transactions - before
+            points = sum(len(sweep_file.read(os.path.join(dest, f))[1])
+                         for f in os.listdir(dest))
+        return points, dict(stats, period=period, writer=board.writer.stats())
+    summary = measure(bus, run, **kw)
+    # the period estimate isn't part of the benchmark
+    summary['transactions_per_point'] = (summary.pop('transactions')
+                                         / max(summary['points'], 1))
+    summary['sweep_time'] = summary['runtime_mean']
+    summary['sweep_time_min'] = summary['runtime_mean']
+    return summary
+
+
+def bench_time_series(board, bus, freq=10e3, repeat=1, num_points=50,
+                      interval=0.05, **kw):
+    '''
+    single frequency time series: a measurement of `repeat` points at
+    `freq` every `interval` seconds, chained after the first
+    '''
+    ad = board.ad
+    ad.single_frequency_mode(freq)
+    def run():
+        points = []
+        def point():
+            points.append(ad.frequency_sweep(repeat=repeat, verbose=False,
+                                             chained=bool(points)))
+        stats = timed_execution(point, interval, num_intervals=num_points)
+        return sum(len(p) for p in points), stats
+    summary = measure(bus, run, **kw)
+    summary['interval'] = interval
+    summary['sweep_time'] /= num_points
+    summary['sweep_time_min'] /= num_points
+    return summary
+
+BENCHMARKS = {'frequency_sweep':bench_frequency_sweep,
+              'full_range':bench_full_range,
+              'continuous':bench_continuous,
+              'time_series':bench_time_series}
+
+
+def run(names=None, latency=LATENCY, rounds=3, memory=True, repeat=5,
+        num_steps=50):
+    '''
+    Runs the benchmarks in `names` (default all, see BENCHMARKS) on a fresh
+    simulated board each and returns the results with a description of the
+    environment.
+    '''
+    names = list(BENCHMARKS) if names is None else names
+    results = {}
+    for name in names:
+        board, bus = sim_board(latency)
+        kw = {'rounds':rounds, 'memory':memory}
+        if name in ('frequency_sweep', 'full_range'):
+            kw.update(repeat=repeat, num_steps=num_steps)
+        elif name == 'continuous':
+            # already several sweeps, always of the default full range
+            kw.update(repeat=repeat, rounds=1)
+        try:
+            results[name] = BENCHMARKS[name](board, bus, **kw)
+        finally:
+            board.close()
+    return {'timestamp':str(datetime.datetime.now()),
+            'version':{'eis_board':eis_board_module.__version__,
+                       'ad5933':ad5933.__version__},
+            'python':sys.version.split()[0], 'platform':platform.platform(),
+            'latency':latency, 'repeat':repeat, 'num_steps':num_steps,
+            'results':results}
+
+
+def compare(baseline, current, tolerance=0.1):
+    '''
+    Lists the COMPARED metrics that got worse by more than `tolerance`
+    (relative, and more than the minimum in COMPARED) from `baseline` to
+    `current` (both as returned by run).
+
+    Returns
+    -------
+    list of tuple
+        (benchmark, metric, baseline value, current value)
+    '''
+    regressions = []
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name, {})
+        for key in COMPARED:
+            if key not in old or key not in result:
+                continue
+            change = result[key] - old[key]
+            if change > max(tolerance*old[key], COMPARED[key]):
+                regressions.append((name, key, old[key], result[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run, from {} (default all)'.format(
+                                ', '.join(BENCHMARKS)))
+    parser.add_argument('-o', '--output', help='JSON file for the results')
+    parser.add_argument('-b', '--baseline',
+                        help='JSON results to check for regressions')
+    parser.add_argument('-l', '--latency', type=float, default=LATENCY,
+                        help='seconds per I2C transaction')
+    parser.add_argument('-r', '--rounds', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--num-steps', type=int, default=50)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc runs')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1)
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmark(s): {}'.format(', '.join(unknown)))
+
+    report = run(args.names or None, latency=args.latency, rounds=args.rounds,
+                 memory=not args.no_memory, repeat=args.repeat,
+                 num_steps=args.num_steps)
+    for name, result in report['results'].items():
+        print('{:16s} {:8.3f} s/sweep {:6.1f} transactions/point'.format(
+                name, result['sweep_time'], result['transactions_per_point']),
+              end='')
+        if 'jitter_max' in result:
+            print('  jitter {:.1f} ms max'.format(1e3*result['jitter_max']),
+                  end='')
+        if 'peak_memory' in result:
+            print('  {:.0f} kB peak'.format(result['peak_memory']/1e3), end='')
+        print()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        for name, key, old, new in regressions:
+            print('regression: {} {} {:.4g} -> {:.4g}'.format(name, key, old,
+                                                               new))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Gain factor and system phase calibration applied while sweeps are acquired.
+
+A calibration sweep of a known resistor (Rcal, 56.2 kohm on the board) gives
+a gain factor gf = 1/(Rcal*|DFT|) and a system phase (the phase of the DFT)
+at each of its frequencies. calibration_table interpolates both to the
+frequencies of a sweep, after which |Z| = 1/(gf*|DFT|) and the phase P is the
+phase of the DFT minus the system phase. This is the same correction (and
+phase convention) as eis_reader.calibrate and data_sweeps.calibrate, done
+once on the Pi instead of in every client.
+"""
+import numpy as np
+
+import sweep_file
+
+RCAL = 56.2e3 # calibration resistor on the EIS board, in ohms
+
+
+class calibration_table():
+    '''
+    Per-frequency gain factor and system phase.
+
+    Parameters
+    ----------
+    freqs : array_like
+        frequencies in Hz, increasing
+    gain_factor : array_like
+        1/(Rcal*|DFT|) at each frequency
+    phase : array_like
+        system phase in radians at each frequency
+    '''
+    def __init__(self, freqs, gain_factor, phase):
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.gain_factor = np.asarray(gain_factor, dtype=float)
+        # unwrapped so that interpolation doesn't go the long way around
+        self.phase = np.unwrap(np.asarray(phase, dtype=float))
+
+    @classmethod
+    def from_sweep(cls, data, Rcal=RCAL):
+        '''
+        from_sweep(data, Rcal=RCAL)
+
+        Builds a table from a sweep of `Rcal` (anything with 'F', 'R', and 'I'
+        fields, e.g. the array returned by ad5933.frequency_sweep). Repeated
+        points are averaged per frequency.
+        '''
+        freqs, index = np.unique(data['F'], return_inverse=True)
+        counts = np.bincount(index)
+        real = np.bincount(index, weights=data['R'])/counts
+        imag = np.bincount(index, weights=data['I'])/counts
+        return cls(freqs, 1/(Rcal*np.hypot(real, imag)),
+                   np.arctan2(imag, real))
+
+    @classmethod
+    def from_file(cls, filename, Rcal=RCAL):
+        '''
+        from_file(filename, Rcal=RCAL)
+
+        Loads a table saved with save (.npz) or builds one from a calibration
+        sweep saved as a binary sweep file or in the text format.
+        '''
+        if filename.endswith('.npz'):
+            with np.load(filename) as f:
+                return cls(f['F'], f['GF'], f['P'])
+        if sweep_file.is_sweep_file(filename):
+            return cls.from_sweep(sweep_file.read(filename, mmap=False)[1], Rcal)
+        text = np.loadtxt(filename, delimiter=',', skiprows=3, ndmin=2)
+        # F,R,I before AD5933 version 1.3, T,F,R,I after
+        columns = text[:, -3:]
+        data = {'F':columns[:,0], 'R':columns[:,1], 'I':columns[:,2]}
+        return cls.from_sweep(data, Rcal)
+
+    def save(self, filename):
+        '''save the table as .npz (see from_file)'''
+        np.savez(filename, F=self.freqs, GF=self.gain_factor, P=self.phase)
+
+    def interpolate(self, freqs):
+        '''
+        interpolate(freqs)
+
+        Returns
+        -------
+        gain_factor, phase : numpy arrays
+            linearly interpolated to `freqs` (held constant outside the table)
+        '''
+        freqs = np.asarray(freqs, dtype=float)
+        return (np.interp(freqs, self.freqs, self.gain_factor),
+                np.interp(freqs, self.freqs, self.phase))
+
+    def apply(self, data, out=None):
+        '''
+        apply(data, out=None)
+
+        Calibrates the raw points of `data` (with 'F', 'R', and 'I' fields).
+
+        Parameters
+        ----------
+        data : numpy structured array
+        out : numpy structured array, optional
+            array with 'M' and 'P' fields to write the results to (e.g. `data`
+            itself if it is in sweep_data.CAL_SWEEP_DTYPE)
+
+        Returns
+        -------
+        magnitude, phase : numpy arrays
+            |Z| in ohms and the calibrated phase in radians
+        '''
+        gf, phase = self.interpolate(data['F'])
+        real = np.asarray(data['R'], dtype=float)
+        imag = np.asarray(data['I'], dtype=float)
+        with np.errstate(divide='ignore'):
+            magnitude = 1/(gf*np.hypot(real, imag))
+        phase = np.arctan2(imag, real) - phase
+        if out is not None:
+            out['M'] = magnitude
+            out['P'] = phase
+        return magnitude, phase
+
+    def __len__(self):
+        return len(self.freqs)
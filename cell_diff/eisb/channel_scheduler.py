@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Interleaved sweeps of several AD5933s behind a TCA9543A I2C switch.
+
+Sweeping the channels one after another makes the sweep period grow linearly
+with the number of channels, although the bus is idle for most of every
+point while a DFT conversion runs. channel_scheduler runs all sweeps at once:
+every channel is initialised before a single shared settling delay, and
+whichever channel's conversion is due next is serviced (switch, read, issue
+the next command) while the others keep converting.
+"""
+import heapq
+import time
+import numpy as np
+
+from sweep_data import sweep_buffer, CAL_SWEEP_DTYPE
+
+
+class _channel_sweep():
+    '''progress of the sweep on one channel'''
+    def __init__(self, ad, repeat):
+        self.ad = ad
+        self.repeat = repeat
+        self.n = 1 # repeat counter
+        self.k = 0 # increment counter
+        self.f = ad.start_freq
+        self.data = sweep_buffer((ad.num_steps+1)*repeat)
+        self.issued = 0.0
+        self.predicted = 0.0
+
+    def issue(self, mode):
+        self.ad.mode = mode
+        self.issued = time.monotonic()
+        self.predicted = self.ad.timer.conversion_time(
+                self.f, self.ad.settle_cycles, self.ad.clock_freq)
+        return self.issued + self.predicted
+
+    def advance(self):
+        '''
+        issues the next measurement and returns when it is due, or None if
+        the sweep is complete
+        '''
+        if self.n < self.repeat:
+            self.n += 1
+            return self.issue('Repeat')
+        if self.k < self.ad.num_steps:
+            self.n = 1
+            self.k += 1
+            self.f += self.ad.freq_step
+            return self.issue('Increment')
+        return None
+
+
+class channel_scheduler():
+    '''
+    Runs the programmed sweeps of several AD5933s concurrently.
+
+    Parameters
+    ----------
+    mux : tca9543a
+        switch the AD5933s are behind
+    ads : dict
+        {channel: ad5933}, each driver talking to the AD5933 on that channel
+    init_delay : float, optional
+        settling time in seconds after Initialize (default is 1.0, as in
+        ad5933.frequency_sweep)
+    poll_interval : float, optional
+        seconds before re-checking a conversion that wasn't ready when due
+        (default is 0.002)
+    '''
+    def __init__(self, mux, ads, init_delay=1.0, poll_interval=0.002):
+        self.mux = mux
+        self.ads = dict(ads)
+        self.init_delay = init_delay
+        self.poll_interval = poll_interval
+        self.last_sweep = {} # timing of the most recent sweep
+
+    def select(self, ch):
+        '''switch to channel `ch` and return its driver'''
+        self.mux.select(ch)
+        return self.ads[ch]
+
+    def sweep(self, repeat=5, channels=None, running=None):
+        '''
+        sweep(repeat=5, channels=None, running=None)
+
+        Sweeps `channels` (default all) with their programmed parameters.
+
+        Parameters
+        ----------
+        repeat : int, optional
+            number of measurements per frequency (default is 5)
+        channels : iterable of int, optional
+            channels to sweep
+        running : callable, optional
+            polled between points, the sweeps stop when it returns False
+
+        Returns
+        -------
+        dict
+            {channel: structured array} with the (T,F,R,I) points of each
+            channel, or (T,F,R,I,M,P) for drivers with a calibration table.
+            T is measured from the start of the first sweep.
+        '''
+        channels = list(self.ads if channels is None else channels)
+        switches = self.mux.switches
+        # initialise every channel first so that they settle together
+        for ch in channels:
+            ad = self.select(ch)
+            ad.mode = 'Standby'
+            ad.mode = 'Initialize'
+        time.sleep(self.init_delay)
+        start = time.monotonic()
+        sweeps = {}
+        due = []
+        for ch in channels:
+            sweeps[ch] = _channel_sweep(self.select(ch), repeat)
+            heapq.heappush(due, (sweeps[ch].issue('Start'), ch))
+        polls = 0
+        while due and (running is None or running()):
+            when, ch = heapq.heappop(due)
+            delay = when - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            sweep = sweeps[ch]
+            ad = self.select(ch)
+            polls += 1
+            if not ad.data_ready():
+                # let the other channels go ahead while this one finishes
+                heapq.heappush(due, (time.monotonic()+self.poll_interval, ch))
+                continue
+            sweep.data.append(time.monotonic()-start, sweep.f, *ad.get_data())
+            when = sweep.advance()
+            if when is not None:
+                heapq.heappush(due, (when, ch))
+        results = {ch:self._finish(sweeps[ch]) for ch in channels}
+        points = sum(len(data) for data in results.values())
+        self.last_sweep = {'time':time.monotonic()-start, 'points':points,
+                           'polls':polls,
+                           'switches':self.mux.switches-switches}
+        return results
+
+    def _finish(self, sweep):
+        '''publish a channel's points on its driver, calibrated if possible'''
+        ad = sweep.ad
+        data = sweep.data
+        if ad.calibration is not None:
+            calibrated = np.zeros(len(data), CAL_SWEEP_DTYPE)
+            for name in data.dtype.names:
+                calibrated[name] = data.data[name]
+            ad.calibration.apply(calibrated, out=calibrated)
+            data = sweep_buffer.wrap(calibrated)
+        ad.sweep_data = data
+        return data.data
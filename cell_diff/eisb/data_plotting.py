@@ -4,36 +4,43 @@ Created on Thu May 16 13:21:19 2019
 
 @author: joeld
 """
-import os, re
 import matplotlib.pyplot as plt
 import numpy as np
-from eis_reader import read_eis_to_array
+from eis_reader import ARRAY_DTYPE
+from sweep_cache import load_all
+from file_index import directory_index
 
 def find_files(base_dir, names, skip_first=False):
-    files = []
-    for name in names:
-        pattern = re.compile(name+r'_ch(\d)_(\d+)\.txt')
-        for filename in os.listdir(base_dir):
-            match = re.match(pattern, filename)
-            if match:
-                ch, i = int(match.group(1)), int(match.group(2))
-                if skip_first and i==0:
-                    continue
-                files.append((os.path.join(base_dir, filename),ch,i))
-    files.sort(key=lambda x: (x[0],x[1]))
-    return files
+    '''
+    (path, channel, iteration) of the sweeps of experiments `names` in 
+    `base_dir`, ordered by name, channel and iteration (numerically), from
+    the directory's persistent index (see file_index.directory_index)
+    '''
+    index = directory_index(base_dir)
+    return [(e.path, e.channel, e.iteration) for e in index.find(
+            names, start=1 if skip_first else None)]
 
-def build_data(files):
+def load_files(files, **kwargs):
+    '''
+    reduced sweep arrays of `files` (as returned by find_files), parsed in
+    parallel and cached next to the files (see sweep_cache.load_all)
+    '''
+    return [d for _, d in load_all([f[0] for f in files], sweep=True, 
+                                   **kwargs)]
+
+def build_data(files, arrays=None):
+    '''arrays from load_files can be passed in to avoid reloading'''
+    arrays = load_files(files) if arrays is None else arrays
     data = [[] for _ in set([c[1] for c in files])]
-    for f in files:
-        _, d = read_eis_to_array(f[0], sweep=True)
+    for f, d in zip(files, arrays):
         data[f[1]].append(d)    
     return data
 
-def build_sweeps(files):
+def build_sweeps(files, arrays=None):
+    '''arrays from load_files can be passed in to avoid reloading'''
+    arrays = load_files(files) if arrays is None else arrays
     sweeps = data_sweeps()
-    for data_file, ch, i in files:
-        _,d = read_eis_to_array(data_file, sweep=True)
+    for (data_file, ch, i), d in zip(files, arrays):
         sweeps.add_sweep(d,ch,i)
     return sweeps
 
@@ -61,11 +68,13 @@ def average_array(arrays):
 
 def process_calibration(base_dir, calibrations, plot=True):
     cal_files = find_files(base_dir, calibrations)
+    cal_arrays = load_files(cal_files) # read once for both views
     
-    cal_data = build_data(cal_files)
+    cal_data = build_data(cal_files, cal_arrays)
     cal_avg =  average_data(cal_data)
     
-    cal_sweeps = build_sweeps(cal_files)
+    # data_sweeps copies the arrays, calibrating it won't change cal_data
+    cal_sweeps = build_sweeps(cal_files, cal_arrays)
     
     cal_fit = [np.poly1d(np.polyfit(ca['F'],ca['M'],1)) for ca in cal_avg]
     
@@ -108,56 +117,162 @@ def process_main3(base_dir, calibrations, data_name, salines, plot_cal=True):
     return cal_avg, cal_sweeps, dat_sweeps, sal_sweeps
 
 class data_sweeps():
+    '''
+    Sweeps of one experiment in a single (sweep x frequency) structured
+    array, `data`, whose fields are the third axis (so data['M'] is a
+    sweep x frequency array). Shorter sweeps are padded with NaN (0 for
+    integer fields). `channel` and `iteration` are index vectors of the
+    sweeps, and groups are selected with masks over them.
+    
+    `sweeps` and filter_group return views into `data`, so changes made
+    through them (or by calibrate) apply to the store. Views taken before
+    more sweeps are added may be left behind when the store grows.
+    '''
     
     def __init__(self):
-        self.channel = []
-        self.iteration = []
-        self.data = {} # dict of list of arrays
-        self.sweeps = [] # list of structured arrays
+        self._n = 0
+        self._lengths = np.zeros(0, dtype=int)
+        self._channel = np.zeros(0, dtype=int)
+        self._iteration = np.zeros(0, dtype=int)
+        self._data = None
+        self._fill = None # padding record
+    
+    @property
+    def channel(self):
+        return self._channel[:self._n]
+    
+    @property
+    def iteration(self):
+        return self._iteration[:self._n]
+    
+    @property
+    def lengths(self):
+        '''number of frequency points of each sweep'''
+        return self._lengths[:self._n]
+    
+    @property
+    def data(self):
+        '''(sweep x frequency) store, with eis_reader.ARRAY_DTYPE fields
+        until the first sweep is added'''
+        if self._data is None:
+            return np.empty((0,0), ARRAY_DTYPE)
+        return self._data[:self._n]
+    
+    @property
+    def sweeps(self):
+        '''list of structured arrays, one per sweep'''
+        data = self.data
+        return [data[k,:n] for k, n in enumerate(self.lengths)]
+    
+    def __len__(self):
+        return self._n
+    
+    def _grow(self, rows, width):
+        '''makes room for `rows` sweeps of up to `width` points'''
+        capacity, old_width = self._data.shape
+        if rows <= capacity and width <= old_width:
+            return
+        # doubling keeps adding a sweep O(1) on average; rows are padded
+        # when they are added, only the sweeps already in need new columns
+        width = max(width, old_width)
+        store = np.empty((max(rows, 2*capacity), width), self._data.dtype)
+        store[:self._n,:old_width] = self._data[:self._n]
+        store[:self._n,old_width:] = self._fill
+        self._data = store
+        for name in ('_lengths', '_channel', '_iteration'):
+            index = np.zeros(store.shape[0], dtype=int)
+            index[:self._n] = getattr(self, name)[:self._n]
+            setattr(self, name, index)
         
     def add_sweep(self, sweep, channel, iteration):
-        self.channel.append(channel)
-        self.iteration.append(iteration)
-        self.sweeps.append(sweep)
-#        if not self.data:
-#            for key in sweep.dtype.names:
-#                self.data[key] = []
-#        for key in sweep.dtype.names:
-#            self.data[key].append(sweep[key])
-#            
-#    def data_to_array(self):
-#        '''call after all sweeps are added'''
-#        for key in self.data:
-#                for i, ch in enumerate(self.data[key]):
-#                    self.data[key][i] = np.array(ch)
+        '''copies structured array `sweep` into the store'''
+        if self._data is None:
+            self._data = np.empty((0, len(sweep)), sweep.dtype)
+            self._fill = np.zeros((), sweep.dtype)
+            for name in sweep.dtype.names:
+                if sweep.dtype[name].kind in 'fc':
+                    self._fill[name] = np.nan
+        elif sweep.dtype != self._data.dtype:
+            raise ValueError('sweeps must all have the fields {}'.format(
+                    self._data.dtype.names))
+        self._grow(self._n+1, len(sweep))
+        k = self._n
+        self._data[k,len(sweep):] = self._fill
+        self._data[k,:len(sweep)] = sweep
+        self._lengths[k] = len(sweep)
+        self._channel[k] = channel
+        self._iteration[k] = iteration
+        self._n += 1
+    
+    def _per_frequency(self, values):
+        '''values of a calibration sweep, padded to the store's width'''
+        width = self._data.shape[1]
+        values = np.asarray(values, dtype=float)
+        if len(values) > width:
+            raise ValueError('calibration has more points than the sweeps')
+        padded = np.full(width, np.nan)
+        padded[:len(values)] = values
+        return padded
     
     def calibrate(self, cal_avg, Rcal=56.2e3):
+        if not self._n:
+            return
+        M = self.data['M']
+        P = self.data['P']
         for i, ch in enumerate(cal_avg):
-            for j, sweep in enumerate(self.sweeps):
-                if self.channel[j] == i:
-                    self.sweeps[j]['M'] = Rcal*ch['M']/sweep['M']
-                    self.sweeps[j]['P'] -= ch['P']
-            
+            rows = self.channel == i
+            M[rows] = Rcal*self._per_frequency(ch['M'])/M[rows]
+            P[rows] -= self._per_frequency(ch['P'])
     
     def calibrate_fit(self, cal_fit, Rcal=56.2e3):
         # TODO need to fit phase too
+        if not self._n:
+            return
+        F = self.data['F']
+        M = self.data['M']
         for i, ch in enumerate(cal_fit):
-            for j, sweep in enumerate(self.sweeps):
-                if self.channel[j] == i:
-                    self.sweeps[j]['M'] = Rcal*ch(sweep['F'])/sweep['M']
+            rows = self.channel == i
+            M[rows] = Rcal*ch(F[rows])/M[rows]
+    
+    def group_mask(self, i, ch, mod=3):
+        '''sweeps on channel `ch` with iteration%mod == i'''
+        return (self.channel == ch) & (self.iteration%mod == i)
                     
     def filter_group(self, i, ch, mod=3):
-        group = []
-        for j, sweep in enumerate(self.sweeps):
-            if self.channel[j] == ch and self.iteration[j]%mod == i:
-                group.append(sweep)
-        return group
+        data, lengths = self.data, self.lengths
+        return [data[k,:lengths[k]] 
+                for k in np.flatnonzero(self.group_mask(i, ch, mod))]
     
     def average_groups(self, ch, mod=3):
-        #TODO debug
-        groups = np.array([self.filter_group(i, ch, mod) for i in range(mod)])
-        avgs = np.average(groups, axis=1)
-        stdevs = np.std(groups, axis=1)
+        '''
+        average_groups(ch, mod=3)
+        
+        Averages and standard deviations of each field over the sweeps of
+        each group i = iteration%mod on channel `ch`.
+        
+        Returns
+        -------
+        avgs, stdevs : structured arrays
+            (mod x frequency), NaN where a group has no points
+        '''
+        data = self.data
+        # points each sweep actually has (the rest is padding)
+        points = np.arange(data.shape[1]) < self.lengths[:,None]
+        avgs = np.full((mod, data.shape[1]), np.nan, 
+                       dtype=[(name, float) for name in data.dtype.names])
+        stdevs = avgs.copy()
+        for i in range(mod):
+            rows = self.group_mask(i, ch, mod)
+            valid = points[rows]
+            counts = valid.sum(axis=0)
+            cols = counts > 0
+            for name in data.dtype.names:
+                values = np.where(valid, data[name][rows], 0.)
+                avg = values.sum(axis=0)[cols]/counts[cols]
+                dev = np.where(valid[:,cols], values[:,cols]-avg, 0.)
+                avgs[name][i,cols] = avg
+                stdevs[name][i,cols] = np.sqrt((dev**2).sum(axis=0)
+                                               /counts[cols])
         return avgs, stdevs
                     
 
@@ -4,14 +4,17 @@ Created on Wed Apr 17 18:59:59 2019
 
 @author: jdunga01
 """
-import time
 import os.path
 import numpy as np
 
-from ad5933 import ad5933
+from ad5933 import ad5933, SweepPlan
 from pi_gpio import pi_gpio
-# from tca9543a import tca9543a
+from tca9543a import tca9543a
+from channel_scheduler import channel_scheduler
 from thread_timing import timed_execution
+from sweep_planner import plan_segments, select_requested
+import sweep_file
+from sweep_writer import sweep_writer
        
 __version__ = '2.00'
 
@@ -21,22 +24,65 @@ class eis_board():
     '''
     NUM_CH = 1 # excluding control
     CAL_CH = 0 # calibration channel number
+    FILE_EXT = '.txt'
     
-    def __init__(self, gpio_kw={}, ad_kw={}):
+    def __init__(self, gpio_kw={}, ad_kw={}, tca_kw=None, channels=(0,1),
+                 writer_kw={}, binary=False):
+        '''
+        binary - bool, save sweeps as binary sweep_file.EXTENSION files
+            instead of text (sweep_file.to_text converts one to .txt)
+        '''
+        if binary:
+            self.FILE_EXT = sweep_file.EXTENSION
         
         # raspberry pi control
         self.rpi = pi_gpio(**gpio_kw)
-        # ad5933 impedance analyzer chip
-        self.ad = ad5933(**ad_kw)
-        self.ad.initialize()
+        # sweeps are saved in the background (see save_data)
+        self.writer = sweep_writer(**writer_kw)
+        if tca_kw is None:
+            # ad5933 impedance analyzer chip
+            self.tca = None
+            self.ads = {0:ad5933(**ad_kw)}
+        else:
+            # one ad5933 per channel of a tca9543a i2c mux
+            self.tca = tca9543a(**tca_kw)
+            self.ads = {}
+            for ch in channels:
+                self.tca.select(ch)
+                self.ads[ch] = ad5933(**ad_kw)
+            self.NUM_CH = len(self.ads)
+            self.scheduler = channel_scheduler(self.tca, self.ads)
+        for ch in self.ads:
+            self.channel(ch)
+            self.ad.initialize()
+        self.channel(min(self.ads))
        
       
     def close(self):
+        self.writer.close()
         self.rpi.cleanup_GPIO()
-        self.ad.deinit()
+        for ad in self.ads.values():
+            ad.deinit()
         
     def channel(self, ch):
-        pass
+        '''
+        Makes channel `ch` the active one (self.ad), switching the i2c mux if
+        the board has one. Boards without a mux have a single channel.
+        '''
+        if self.tca is None:
+            self.ad = self.ads[0]
+            return
+        self.tca.select(ch)
+        self.ad = self.ads[ch]
+        
+    def save_data(self, data, filename, ch=None):
+        '''
+        Queues sweep data to be written to `filename` by the background 
+        writer, with the current settings of channel `ch` (default the active
+        channel) as metadata.
+        '''
+        ad = self.ad if ch is None else self.ads.get(ch, self.ad)
+        self.writer.submit(filename, data, ad.file_metadata())
         
     def single_frequency(self, ch, freq, repeat=5, delay=500):
         '''
@@ -51,7 +97,8 @@ class eis_board():
         '''
         datas = self.alternating_single_frequency(*args, **kwargs)
         for ch in range(self.NUM_CH-1):
-            self.ad.write_data_to_file(datas[ch],'{}_dat_{}.txt'.format(name,ch))
+            self.ad.write_data_to_file(datas[ch],'{}_dat_{}{}'.format(
+                name,ch,self.FILE_EXT))
 
     def save_continuous_sweeps(self, name, dest='', repeat=5, Ts=300.0, ch=[],
                                num_sweeps=None, sweep_type='full_range'):
@@ -83,8 +130,15 @@ class eis_board():
             The number of sweeps to be executed. Default is None, in which case
             the sweeps will be repeated until the user enters "q" into the 
             command line.
-        sweep_type : {'alternating','independent','low_freq','full_range'}
-            Enables other sweep modes (default is 'alternating').
+        sweep_type : {'full_range','multi_channel'}
+            Enables other sweep modes (default is 'full_range'). 
+            'multi_channel' runs the programmed sweeps of all channels at
+            once (see multi_channel_sweep).
+        
+        Returns
+        -------
+        dict
+            timing statistics of the sweeps, see thread_timing.timed_execution
         '''
         progress = [] # iteration number will be stored in the length of this
                       # progress list because threads need a mutable object
@@ -101,60 +155,86 @@ class eis_board():
 #            timed_execution(self.save_test, Ts, *func_args, 
 #                            num_intervals=num_sweeps)
         if sweep_type == 'full_range':
-            timed_execution(self.save_full_range_sweep, Ts, *func_args,  
-                            num_intervals=num_sweeps, **func_kwargs)
+            stats = timed_execution(self.save_full_range_sweep, Ts, *func_args,
+                                    num_intervals=num_sweeps, **func_kwargs)
+        elif sweep_type == 'multi_channel':
+            stats = timed_execution(self.save_multi_channel_sweep, Ts, 
+                                    *func_args, num_intervals=num_sweeps, 
+                                    **func_kwargs)
         else:
-            raise ValueError("sweep_type must be one of 'alternating', "
-                             "'independent', 'full_range', or 'low_freq'")
+            raise ValueError("sweep_type must be one of 'full_range' or "
+                             "'multi_channel'")
+        # don't return before the last sweep is on disk
+        self.writer.flush()
+        return stats
 
-    def freq_sweep_full_range(self, ch, repeat=10, num_steps=50):
+    def freq_sweep_full_range(self, ch, repeat=10, num_steps=50, tol=0.01,
+                              init_delay=1.0):
         '''
         sweep from 1k to 100k using `num_steps` log-spaced frequencies
         
-        note that this method is probably very inefficient because it
-        implements the sweep a series of single frequency measurements, so the
-        ad5933 is initialized and powered down at every frequency.
+        The frequencies are planned as a few linear hardware sweeps (see
+        sweep_planner.plan_segments), each within `tol` relative error of the
+        requested frequencies, which are restored in the returned data. Each
+        sweep settles for `init_delay` seconds after Initialize (see 
+        ad5933.frequency_sweep), which the planner weighs against measuring
+        extra points (conversions and bus traffic, see 
+        ad5933.point_overhead), with at most 4 increments per requested 
+        frequency. Below 10 kHz a point (settling cycles and repeats at 
+        the divided clock) takes about as long, so that band still needs
+        several sweeps.
         '''
         freqs = np.round(np.logspace(3,5,num=num_steps))
         self.channel(ch)
         ad = self.ad
+        # estimated time per point (conversions plus the bus traffic of each
+        # repeat), so the planner can trade sweep setups against extra points
+        point_time = lambda f, div: repeat*ad.timer.conversion_time(
+                f, ad.settle_cycles, ad.clock_freq/div)
+        segments = plan_segments(freqs, tol, setup_time=init_delay,
+                                 point_time=point_time,
+                                 point_overhead=repeat*ad.point_overhead())
         # save previous sweep params
-        start_old, step_old, num_old = ad.start_freq, ad.freq_step, ad.num_steps
-        # execute sweep as a series of single point measurements
+        restore = SweepPlan.compile(ad.clock_freq, 1, ad.start_freq, 
+                                    ad.freq_step, ad.num_steps, ad.settle_cycles)
         data = []
-        for freq in freqs:
-            if freq < 10e3:
-                ad.single_frequency_mode(freq*4)
-                self.rpi.set_clock_divide(4)
+        for seg in segments:
+            # slowing down the clock also slows the DDS, so the source
+            # frequencies need to be adjusted as well (pi_gpio skips 
+            # settings that are already in place)
+            if seg.divider > 1:
+                self.rpi.set_clock_divide(seg.divider)
                 self.rpi.enable_clock_divider()
-                time.sleep(0.1)
-                data += ad.frequency_sweep(repeat=repeat, verbose=True, 
-                                         freq_reporting_factor=4)
-                self.rpi.disable_clock_divider()
             else:
-                ad.single_frequency_mode(freq)
-                data += ad.frequency_sweep(repeat=repeat, verbose=True)
-            print(data)
+                self.rpi.disable_clock_divider()
+            self.rpi.wait_settled(ad.clock_freq)
+            ad.apply_plan(SweepPlan.compile(ad.clock_freq, seg.divider, 
+                                            seg.start, seg.step, 
+                                            seg.num_increments, 
+                                            ad.settle_cycles))
+            dat = ad.frequency_sweep(repeat=repeat, verbose=False,
+                                     freq_reporting_factor=seg.divider,
+                                     init_delay=init_delay)
+            data.append(select_requested(seg, dat))
+        self.rpi.disable_clock_divider()
         
         # restore parameters
-        ad.start_freq, ad.freq_step, ad.num_steps = start_old, step_old, num_old
-        ad.write_sweep_params()
-        return data        
+        ad.apply_plan(restore)
+        return np.concatenate(data)
 
     def save_full_range_sweep(self, name, ch=[], progress=[], repeat=5, num_steps=50):
         '''
         Executes a full range (1-100kHz) sweep and saves it to file.
         
         Executes a full range (1-100kHz) sweep (using `num_steps` log-spaced
-        frequencies) and saves the data to file using the ad5933's 
-        write_data_to_file method.
+        frequencies) and queues the data to be saved (see save_data).
         
         Parameters
         ----------
         name : str
             A name (and directory location if desired) for the data file to be
             written to disk. The channel number and sweep iteration will be
-            appended along with a .txt file extension
+            appended along with the FILE_EXT file extension
         progress : list, optional
             `progress` is primarily used by eis_board.save_continuous_sweeps,
             which needs a mutable object to keep track of the number of 
@@ -170,25 +250,56 @@ class eis_board():
         for chan in channels:
             data = self.freq_sweep_full_range(ch=chan, repeat=repeat, 
                                              num_steps=num_steps)
-            filename = '{}_ch{}_{}.txt'.format(name,chan,len(progress))
-            self.ad.write_data_to_file(data,filename)
+            filename = '{}_ch{}_{}{}'.format(name,chan,len(progress),
+                                             self.FILE_EXT)
+            self.save_data(data,filename)
         progress.append(True)
                
     def freq_sweep(self, ch, repeat=5):
         self.channel(ch)
         return self.ad.frequency_sweep(repeat=repeat)
+    
+    def multi_channel_sweep(self, ch=[], repeat=5):
+        '''
+        Sweeps several channels at once (see channel_scheduler) with their
+        programmed sweep parameters.
+        
+        Returns
+        -------
+        dict
+            {channel: structured array} of each channel's sweep data
+        '''
+        channels = ch if ch else list(self.ads)
+        if self.tca is None:
+            return {c:self.freq_sweep(c, repeat=repeat) for c in channels}
+        data = self.scheduler.sweep(repeat=repeat, channels=channels)
+        # the scheduler may leave the mux on any channel, select the last one
+        # so the mux and self.ad agree
+        self.channel(channels[-1])
+        return data
+    
+    def save_multi_channel_sweep(self, name, ch=[], progress=[], repeat=5):
+        '''
+        Executes a multi channel sweep (see multi_channel_sweep) and saves 
+        each channel's data to file, named as by save_freq_sweep.
+        '''
+        for chan, data in self.multi_channel_sweep(ch, repeat).items():
+            filename = '{}_ch{}_{}{}'.format(name,chan,len(progress),
+                                             self.FILE_EXT)
+            self.save_data(data,filename,ch=chan)
+        progress.append(True)
         
     def save_freq_sweep(self, name, progress=[], repeat=5):
         '''
         Executes a frequency sweep (using fixed value sweep parameters) and 
-        saves the data to file using the ad5933's write_data_to_file method.
+        queues the data to be saved (see save_data).
         
         Parameters
         ----------
         name : str
             A name (and directory location if desired) for the data file to be
             written to disk. The channel number and sweep iteration will be
-            appended along with a .txt file extension
+            appended along with the FILE_EXT file extension
         progress : list, optional
             `progress` is primarily used by eis_board.save_continuous_sweeps,
             which needs a mutable object to keep track of the number of 
@@ -202,8 +313,9 @@ class eis_board():
         '''
         for ch in range(self.NUM_CH):
             data = self.freq_sweep(ch=ch, repeat=repeat)
-            filename = '{}_ch{}_{}.txt'.format(name,ch,len(progress))
-            self.ad.write_data_to_file(data,filename)
+            filename = '{}_ch{}_{}{}'.format(name,ch,len(progress),
+                                             self.FILE_EXT)
+            self.save_data(data,filename)
         progress.append(True)
 
 
@@ -4,61 +4,105 @@ Created on Thu Apr 25 09:26:45 2019
 
 @author: joeld
 """
+import warnings
 import numpy as np
 import matplotlib.pyplot as plt
+import sweep_file
 
-def read_eis(filepath):
+# columns of the arrays returned by read_eis
+COLUMNS = ('T','F','R','I')
+# fields of the arrays returned by data_to_array: time, frequency, real, 
+# imaginary, magnitude, phase, and for sweeps the standard deviations of real
+# and imaginary and the number of repeats that were averaged
+ARRAY_DTYPE = np.dtype([('T','<f8'), ('F','<f8'), ('R','<f8'), ('I','<f8'),
+                        ('M','<f8'), ('P','<f8'), ('SR','<f8'), ('SI','<f8'),
+                        ('N','<i4')])
+
+def read_header(f):
+    '''
+    Reads the metadata line, blank line, and column names line of a text 
+    sweep file open in `f`, returns (metadata, column names).
+    '''
     metadata = {}
-    data = []
+    for pair in f.readline().split(','):
+        key, value = pair.split(':',1)
+        metadata[key.strip()] = value.strip()
+    f.readline()
+    # F,R,I or T,F,R,I as of AD5933 version 1.3 (+M,P if calibrated)
+    names = [name.strip() for name in f.readline().split(',')]
+    return metadata, names
+
+def read_eis(filepath):
+    '''
+    Reads a sweep saved as text or as a binary sweep file (see sweep_file). 
     
-    with open(filepath, 'r') as f:
-        header = f.readline()
-        for pair in header.split(','):
-            key, value = pair.split(':',1)
-            metadata[key.strip()] = value.strip()
-        f.readline()
-        f.readline() # F,R,I or T,F,R,I as of AD5933 version 1.3
-        for line in f:
-            if line:
-                data.append([float(d) for d in line.split(',')])
+    Returns
+    -------
+    metadata : dict
+    data : numpy.ndarray
+        float64 array with one (T,F,R,I) row per point (see COLUMNS). Files
+        in the old F,R,I layout have NaN times.
+    
+    The numbers are parsed in one call to numpy.loadtxt and binary files are
+    memory-mapped, so nothing is converted value by value in Python.
+    '''
+    if sweep_file.is_sweep_file(filepath):
+        metadata, records = sweep_file.read(filepath)
+        names = records.dtype.names
+        values = None
+    else:
+        with open(filepath, 'r') as f:
+            metadata, names = read_header(f)
+            with warnings.catch_warnings():
+                # an empty body (e.g. a sweep that was stopped) is allowed
+                warnings.simplefilter('ignore', UserWarning)
+                values = np.loadtxt(f, delimiter=',', ndmin=2)
+        if values.size == 0:
+            values = values.reshape(0, len(names))
+    data = np.full((len(values) if values is not None else len(records), 
+                    len(COLUMNS)), np.nan)
+    for i, name in enumerate(COLUMNS):
+        if name in names:
+            data[:,i] = records[name] if values is None \
+                        else values[:,names.index(name)]
     return metadata, data
 
 def data_to_array(data, sweep=True):
-    averaged = [[],[],[],[]]
+    '''
+    Converts (T,F,R,I) rows (as returned by read_eis) to a structured array
+    of ARRAY_DTYPE with the magnitude M and phase P of the DFT.
+    
+    With `sweep`, repeated measurements are grouped by frequency (sorted 
+    ascending) into their mean time, real and imaginary, the sample standard
+    deviations SR and SI of the real and imaginary parts, and the number of
+    repeats N. Otherwise every row is kept (SR = SI = 0, N = 1).
+    '''
+    data = np.asarray(data)
+    if data.dtype.names is not None: # e.g. sweep_file records
+        data = np.column_stack([data[name] for name in COLUMNS])
+    data = data.astype(np.float64, copy=False).reshape(-1, len(COLUMNS))
     if sweep:
         # data may be repeated for a given frequency - regroup by frequency
-        by_freq = {}
-        for row in data: # row is [T,F,R,I]
-            if row[1] in by_freq:
-                by_freq[row[1]][0].append(row[0])
-                by_freq[row[1]][1].append(row[2])
-                by_freq[row[1]][2].append(row[3])
-            else:
-                by_freq[row[1]] = [[row[0]],[row[2]],[row[3]]]
-        # average each frequency
-        for freq in sorted(by_freq):
-            averaged[0].append(np.average(np.array(by_freq[freq][0])))
-            averaged[1].append(freq)
-            averaged[2].append(np.average(np.array(by_freq[freq][1])))
-            averaged[3].append(np.average(np.array(by_freq[freq][2])))
+        freqs, group, n = np.unique(data[:,1], return_inverse=True,
+                                    return_counts=True)
+        d = np.zeros(len(freqs), dtype=ARRAY_DTYPE)
+        d['F'] = freqs
+        d['N'] = n
+        for name, col in (('T',0), ('R',2), ('I',3)):
+            d[name] = np.bincount(group, data[:,col], len(freqs))/n
+        ddof = np.maximum(n-1, 1) # single measurements have std 0
+        for name, col in (('SR',2), ('SI',3)):
+            deviation = data[:,col] - d[name[1]][group]
+            d[name] = np.sqrt(np.bincount(group, deviation**2, 
+                                          len(freqs))/ddof)
     else: # single frequency
-        for row in data:
-            for i,d in enumerate(row):
-                averaged[i].append(d)
-
-    averaged = np.array(averaged)
+        d = np.zeros(len(data), dtype=ARRAY_DTYPE)
+        for i, name in enumerate(COLUMNS):
+            d[name] = data[:,i]
+        d['N'] = 1
     
     # calculate other useful data from real and imaginary parts
-    # freq, real, imag, mag, phase
-    structure = np.dtype({'names':('T','F','R','I','M','P'),
-                          'formats':(np.float64, np.float64,np.float64,
-                                     np.float64, np.float64,np.float64)})
-    d = np.zeros(averaged.shape[1], dtype=structure)
-    d['T'] = averaged[0]
-    d['F'] = averaged[1]
-    d['R'] = averaged[2]
-    d['I'] = averaged[3]
-    d['M'] = np.sqrt(d['R']**2+d['I']**2)
+    d['M'] = np.hypot(d['R'], d['I'])
     d['P'] = np.arctan2(d['I'],d['R'])
     return d
 
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent index of the sweep files in a data directory.
+
+eis_board saves sweeps as <name>_ch<channel>_<iteration>.txt (or .eisb).
+directory_index parses every file name once, keeps
+{name: {channel: {iteration: entry}}} with each file's size and mtime, and
+stores it as JSON in the directory's sweep_cache.CACHE_DIR. Later updates
+skip the directory listing while the directory's mtime is unchanged (no
+files added, removed, or replaced) and only parse names that weren't seen
+before. Lookups are dict accesses and iterations come out in numeric order
+(2 before 10).
+
+Editing or appending to a file in place doesn't change the directory's
+mtime, so until the next listing (update(force=True), or any file added or
+removed) its entry keeps the old size and mtime. Paths and sweep numbers
+are still right; sweep_cache checks each file's own size and mtime before
+using a cached array.
+"""
+import bisect
+import json
+import os
+import re
+from collections import namedtuple
+
+from sweep_cache import CACHE_DIR
+
+FILE_PATTERN = re.compile(r'(.+)_ch(\d+)_(\d+)\.(txt|eisb)$')
+INDEX_NAME = 'index.json'
+_VERSION = 2
+
+index_entry = namedtuple('index_entry', 'path name channel iteration size '
+                                        'mtime')
+
+
+class directory_index():
+    '''
+    Index of the sweep files in `directory`.
+
+    Parameters
+    ----------
+    directory : str
+    persist : bool, optional
+        load the index from and save it to the directory's cache (default is
+        True, ignored if the directory is read-only)
+
+    If a sweep is saved both as text and binary, the binary file is indexed.
+    '''
+    def __init__(self, directory, persist=True):
+        self.directory = os.path.abspath(directory)
+        self.persist = persist
+        self._dir_mtime = None
+        self._files = {} # {filename: index_entry or None (not a sweep)}
+        self._tree = {} # {name: {channel: {iteration: index_entry}}}
+        self._sorted = {} # {(name, channel): sorted iterations}
+        if persist:
+            self._load()
+        self.update()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, CACHE_DIR, INDEX_NAME)
+
+    def update(self, force=False):
+        '''
+        Brings the index up to date. Returns True if the directory changed.
+
+        Without `force` the directory is only listed if its mtime changed,
+        so a file rewritten in place (same name) is picked up with the next
+        added or removed file, or with `force`.
+        '''
+        if self.persist:
+            # before taking the mtime, creating it changes the directory
+            try:
+                os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            except OSError:
+                pass
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self._dir_mtime and not force:
+            return False
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for e in entries:
+                match = self._files[e.name] if e.name in self._files \
+                        else FILE_PATTERN.match(e.name)
+                if not match:
+                    files[e.name] = None
+                    continue
+                if isinstance(match, index_entry):
+                    name, ch, i = match.name, match.channel, match.iteration
+                else:
+                    name, ch, i = (match.group(1), int(match.group(2)),
+                                   int(match.group(3)))
+                st = e.stat()
+                files[e.name] = index_entry(e.path, name, ch, i, st.st_size,
+                                            st.st_mtime_ns)
+        self._files = files
+        self._dir_mtime = mtime
+        self._build()
+        if self.persist:
+            self._save()
+        return True
+
+    def _build(self):
+        tree = {}
+        for entry in self._files.values():
+            if entry is None:
+                continue
+            iterations = tree.setdefault(entry.name, {}).setdefault(
+                    entry.channel, {})
+            other = iterations.get(entry.iteration)
+            if other is None or other.path.endswith('.txt'):
+                iterations[entry.iteration] = entry
+        self._tree = tree
+        self._sorted = {}
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index['version'] != _VERSION or \
+                    index['directory'] != self.directory:
+                return
+            files = {}
+            for filename, fields in index['files'].items():
+                # {filename: [name, channel, iteration, size, mtime] or None}
+                files[filename] = None if fields is None else index_entry(
+                        os.path.join(self.directory, filename), 
+                        str(fields[0]), *(int(x) for x in fields[1:]))
+            mtime = int(index['mtime'])
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return
+        self._dir_mtime = mtime
+        self._files = files
+        self._build()
+
+    def _save(self):
+        path = self.index_path
+        try:
+            files = {filename:None if e is None else list(e[1:])
+                     for filename, e in self._files.items()}
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump({'version':_VERSION, 'directory':self.directory,
+                           'mtime':self._dir_mtime, 'files':files}, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    # -- lookups -------------------------------------------------------------
+    def names(self):
+        '''experiment names in the directory, sorted'''
+        return sorted(self._tree)
+
+    def channels(self, name):
+        '''channels of experiment `name`, sorted'''
+        return sorted(self._tree.get(name, ()))
+
+    def get(self, name, channel, iteration):
+        '''index_entry of one sweep, or None'''
+        return self._tree.get(name, {}).get(channel, {}).get(iteration)
+
+    def iterations(self, name, channel, start=None, stop=None):
+        '''
+        iterations(name, channel, start=None, stop=None)
+
+        index_entry of each sweep of `name` on `channel` with iteration
+        start <= i < stop, in numeric order
+        '''
+        entries = self._tree.get(name, {}).get(channel)
+        if not entries:
+            return []
+        key = (name, channel)
+        order = self._sorted.get(key)
+        if order is None:
+            order = self._sorted[key] = sorted(entries)
+        lo = 0 if start is None else bisect.bisect_left(order, start)
+        hi = len(order) if stop is None else bisect.bisect_left(order, stop)
+        return [entries[i] for i in order[lo:hi]]
+
+    def find(self, names, channels=None, start=None, stop=None):
+        '''
+        find(names, channels=None, start=None, stop=None)
+
+        index_entry of the sweeps of each of `names` (on `channels`, default
+        all) ordered by name, channel and iteration
+        '''
+        found = []
+        for name in sorted(set(names)):
+            for ch in self.channels(name) if channels is None else \
+                    sorted(channels):
+                found.extend(self.iterations(name, ch, start, stop))
+        return found
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+One I2C bus shared by several drivers, with priority arbitration.
+
+The LoS peripherals (MCP9600 thermocouple, MCP23017 valve driver) and the
+AD5933 are on the same pins. bus_manager owns the physical bus and hands out
+bus_client objects, which behave like busio.I2C and can be passed to the
+drivers in its place:
+
+    bus = bus_manager(busio.I2C(board.SCL, board.SDA))
+    tc = adafruit_mcp9600.MCP9600(bus.client('safety'))
+    mcp = MCP23017(bus.client('valve'))
+    ad = ad5933(i2c=bus.client('sweep'))
+
+A client's try_lock waits for the bus, and whenever the bus is released it
+goes to the waiting client of the highest priority class (PRIORITY_CLASSES,
+first come first served within a class). A client keeps the bus for a whole
+locked block (e.g. one `with I2CDevice` block), so the transactions of a
+block are never interleaved with others, but a block isn't preempted either.
+
+Clients created with `coalesce` (seconds) answer a register read with the
+result of an identical read (same address, register bytes and length) made
+by a coalescing client within that window, without using the bus. That is
+meant for readings several threads poll independently, such as the
+temperature.
+Any write to the device discards its cached reads.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+# priority of each class, lower goes first
+PRIORITY_CLASSES = {'safety':0, 'valve':1, 'sweep':2}
+
+
+class _class_stats():
+    '''lock contention of one priority class'''
+    __slots__ = ('acquired', 'wait', 'wait_max', 'hold', 'hold_max',
+                 'transactions', 'coalesced')
+
+    def __init__(self):
+        self.acquired = 0
+        self.wait = 0.0
+        self.wait_max = 0.0
+        self.hold = 0.0
+        self.hold_max = 0.0
+        self.transactions = 0
+        self.coalesced = 0
+
+    def summary(self):
+        n = max(self.acquired, 1)
+        return {'acquired':self.acquired, 'wait_total':self.wait,
+                'wait_mean':self.wait/n, 'wait_max':self.wait_max,
+                'hold_total':self.hold, 'hold_mean':self.hold/n,
+                'hold_max':self.hold_max, 'transactions':self.transactions,
+                'coalesced':self.coalesced}
+
+
+class bus_manager():
+    '''
+    Owner of a busio.I2C compatible bus that arbitrates between clients.
+
+    Parameters
+    ----------
+    bus : busio.I2C compatible bus
+        the physical bus, locked by the manager until deinit
+    '''
+    def __init__(self, bus):
+        self.bus = bus
+        while not bus.try_lock():
+            pass
+        self._cond = threading.Condition()
+        self._owner = None
+        self._locked_at = 0.0
+        self._waiting = [] # heap of (priority, sequence) tickets
+        self._sequence = itertools.count()
+        self._stats = {name:_class_stats() for name in PRIORITY_CLASSES}
+        self._recent = {} # {(address, register bytes, length): (time, result)}
+
+    def client(self, priority, coalesce=0.0):
+        '''
+        client(priority, coalesce=0.0)
+
+        Returns a busio.I2C compatible bus_client in priority class
+        `priority` (a key of PRIORITY_CLASSES) that reuses reads made within
+        the last `coalesce` seconds.
+        '''
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError('priority must be one of {}'.format(
+                    tuple(PRIORITY_CLASSES)))
+        return bus_client(self, priority, coalesce)
+
+    @property
+    def frequency(self):
+        return getattr(self.bus, 'frequency', None)
+
+    def acquire(self, client, blocking=True):
+        '''lock the bus for `client`, returns False if it can't (yet)'''
+        requested = time.monotonic()
+        with self._cond:
+            if self._owner is client:
+                return False # not reentrant, like busio.I2C.try_lock
+            ticket = (PRIORITY_CLASSES[client.priority],
+                      next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            while self._owner is not None or self._waiting[0] != ticket:
+                if not blocking:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    return False
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._owner = client
+            self._locked_at = time.monotonic()
+            stats = self._stats[client.priority]
+            waited = self._locked_at - requested
+            stats.acquired += 1
+            stats.wait += waited
+            stats.wait_max = max(stats.wait_max, waited)
+            return True
+
+    def release(self, client):
+        '''unlock the bus held by `client`'''
+        with self._cond:
+            if self._owner is not client:
+                raise RuntimeError('bus is not locked by this client')
+            held = time.monotonic() - self._locked_at
+            stats = self._stats[client.priority]
+            stats.hold += held
+            stats.hold_max = max(stats.hold_max, held)
+            self._owner = None
+            self._cond.notify_all()
+
+    def _check(self, client):
+        if self._owner is not client:
+            raise RuntimeError('bus must be locked (try_lock) by this client')
+        self._stats[client.priority].transactions += 1
+
+    def _cached(self, client, key):
+        recent = self._recent.get(key)
+        if recent is not None and time.monotonic() - recent[0] <= \
+                client.coalesce:
+            stats = self._stats[client.priority]
+            stats.coalesced += 1
+            return recent[1]
+        return None
+
+    def _forget(self, address):
+        for key in [key for key in self._recent if key[0] == address]:
+            del self._recent[key]
+
+    def stats(self):
+        '''
+        Returns
+        -------
+        dict
+            per priority class: locks acquired, total, mean and maximum
+            seconds waited for and held the bus, transactions, and reads
+            answered by coalescing
+        '''
+        with self._cond:
+            return {name:stats.summary()
+                    for name, stats in self._stats.items()}
+
+    def deinit(self):
+        '''release the physical bus'''
+        self.bus.unlock()
+
+
+class bus_client():
+    '''
+    busio.I2C compatible handle to a bus_manager (see bus_manager.client)
+
+    try_lock waits until the manager grants the bus, so drivers that spin on
+    it (adafruit_bus_device.I2CDevice) don't poll.
+    '''
+    def __init__(self, manager, priority, coalesce=0.0):
+        self.manager = manager
+        self.priority = priority
+        self.coalesce = coalesce
+
+    @property
+    def frequency(self):
+        return self.manager.frequency
+
+    def try_lock(self):
+        return self.manager.acquire(self)
+
+    def unlock(self):
+        self.manager.release(self)
+
+    def scan(self):
+        self.manager._check(self)
+        return self.manager.bus.scan()
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self.manager._check(self)
+        self.manager._forget(address)
+        self.manager.bus.writeto(address, buffer, start=start, end=end)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        self.manager._check(self)
+        self.manager.bus.readfrom_into(address, buffer, start=start, end=end)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0,
+                              in_end=None):
+        manager = self.manager
+        in_end = len(buffer_in) if in_end is None else in_end
+        key = None
+        if self.coalesce:
+            key = (address, bytes(buffer_out[out_start:out_end]),
+                   in_end-in_start)
+            result = manager._cached(self, key)
+            if result is not None:
+                buffer_in[in_start:in_end] = result
+                return
+        manager._check(self)
+        manager.bus.writeto_then_readfrom(address, buffer_out, buffer_in,
+                                          out_start=out_start,
+                                          out_end=out_end, in_start=in_start,
+                                          in_end=in_end)
+        if key is not None:
+            manager._recent[key] = (time.monotonic(),
+                                    bytes(buffer_in[in_start:in_end]))
+
+    def deinit(self):
+        pass # the bus belongs to the manager
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated I2C bus and AD5933 for running the EIS code without a Raspberry Pi.
+
+sim_bus stands in for busio.I2C and I2CDevice for
+adafruit_bus_device.i2c_device.I2CDevice, so the drivers run unchanged on top
+of them. sim_ad5933 implements the AD5933 register map and command set, with
+conversion timing taken from MCLK and the settling cycles, and returns the DFT
+of a configurable load (see resistor, rc_load, and randles_load).
+sim_tca9543a switches devices behind its channels onto the bus, so several
+AD5933s can share their fixed address.
+
+Example
+-------
+    bus = sim_bus()
+    bus.attach(ad5933.ADDR, sim_ad5933(rc_load(10e3, 10e-9)))
+    ad = ad5933(i2c=bus)
+
+    # external clock divided down by the pi_gpio `rpi`
+    sim_ad5933(resistor(100e3), clock_divider=lambda: rpi.clock_divide)
+
+    mux = bus.attach(0x70, sim_tca9543a())
+    mux.attach(1, ad5933.ADDR, sim_ad5933(resistor(56.2e3)))
+"""
+import cmath, math
+import errno
+import random
+import threading
+import time
+
+
+class resistor():
+    '''purely resistive load'''
+    def __init__(self, r):
+        self.r = r
+
+    def __call__(self, f):
+        return complex(self.r)
+
+
+class rc_load():
+    '''
+    resistor and capacitor in parallel (default) or in series
+
+    Parameters
+    ----------
+    r : float
+        resistance in ohms
+    c : float
+        capacitance in farads
+    series : bool, optional
+        connect r and c in series instead of in parallel (default is False)
+    '''
+    def __init__(self, r, c, series=False):
+        self.r, self.c, self.series = r, c, series
+
+    def __call__(self, f):
+        zc = 1/(2j*math.pi*f*self.c)
+        if self.series:
+            return self.r + zc
+        return self.r*zc/(self.r + zc)
+
+
+class randles_load():
+    '''
+    Randles cell: solution resistance in series with a double layer capacitance
+    that is in parallel with the charge transfer resistance (and an optional
+    semi-infinite Warburg element)
+
+    Parameters
+    ----------
+    rs : float
+        solution resistance in ohms
+    rct : float
+        charge transfer resistance in ohms
+    cdl : float
+        double layer capacitance in farads
+    sigma : float, optional
+        Warburg coefficient in ohm/sqrt(s) (default is 0, no diffusion)
+    '''
+    def __init__(self, rs, rct, cdl, sigma=0.0):
+        self.rs, self.rct, self.cdl, self.sigma = rs, rct, cdl, sigma
+
+    def __call__(self, f):
+        w = 2*math.pi*f
+        zf = self.rct + self.sigma*(1-1j)/math.sqrt(w)
+        return self.rs + 1/(1/zf + 1j*w*self.cdl)
+
+
+class sim_ad5933():
+    '''
+    register-level emulation of an AD5933 measuring `load`
+
+    Conversions take as long as they would on the chip (settling cycles at the
+    output frequency plus a 1024 point DFT sampled at MCLK/16) unless
+    `realtime` is False, in which case they complete immediately. The real and
+    imaginary results are proportional to the admittance of the load, scaled
+    by the output range and PGA gain, rotated by `system_phase`, with optional
+    gaussian noise, and saturate at the 16-bit limits.
+
+    Parameters
+    ----------
+    load : callable
+        returns the complex impedance of the load at a frequency in Hz
+    mclk : float, optional
+        external clock frequency in Hz (default is 16e6)
+    clock_divider : int or callable, optional
+        divider between the external clock and the chip, or a function
+        returning the current one, e.g. the clock_divide of the pi_gpio
+        driving the divider (default is 1)
+    gain : float, optional
+        DFT magnitude of a 1 ohm load at 2 Vpp and PGA x1 (default is 1e9)
+    system_phase : float, optional
+        phase offset of the measurement path in radians (default is 0)
+    noise : float, optional
+        standard deviation of the noise added to real and imag (default is 0)
+    realtime : bool, optional
+        model conversion time (default is True)
+    seed : int, optional
+        seed for the noise generator
+    '''
+    INTERNAL_CLOCK = 16.776e6
+    DFT_SAMPLES = 1024
+    # D10-D9 code -> output amplitude relative to 2 Vpp
+    RANGE_SCALE = {0b00:1.0, 0b11:0.5, 0b10:0.2, 0b01:0.1}
+
+    def __init__(self, load, mclk=16e6, gain=1e9, system_phase=0.0, noise=0.0,
+                 realtime=True, seed=None, clock_divider=1):
+        self.load = load
+        self.mclk = mclk
+        self.clock_divider = clock_divider
+        self.gain = gain
+        self.system_phase = system_phase
+        self.noise = noise
+        self.realtime = realtime
+        self._random = random.Random(seed)
+
+        self.registers = bytearray(256)
+        self.registers[0x80] = 0b10100000 # power-down at power-up
+        self.registers[0x92:0x94] = (25*32).to_bytes(2, 'big') # 25 degC
+        self._pointer = 0
+        self._block = 0 # length of a pending block read
+        self._increments = 0 # increments done since Initialize
+        self._ready_at = None # time the running conversion completes
+        self.conversions = 0
+
+    # -- register helpers ----------------------------------------------------
+    def _word(self, reg, n):
+        return int.from_bytes(self.registers[reg:reg+n], 'big')
+
+    @property
+    def clock(self):
+        '''clock frequency currently seen by the chip'''
+        if self.registers[0x81] & 0b00001000:
+            divider = self.clock_divider
+            return self.mclk/(divider() if callable(divider) else divider)
+        return self.INTERNAL_CLOCK
+
+    def _code_to_freq(self, code):
+        return code*(self.clock/4)/2**27
+
+    @property
+    def frequency(self):
+        '''current output frequency in Hz'''
+        start = self._word(0x82, 3)
+        step = self._word(0x85, 3)
+        return self._code_to_freq(start + self._increments*step)
+
+    @property
+    def num_increments(self):
+        return self._word(0x88, 2) & 0x1ff
+
+    @property
+    def settle_cycles(self):
+        word = self._word(0x8a, 2)
+        multiplier = {0b00:1, 0b01:2, 0b11:4}.get((word >> 9) & 0b11, 1)
+        return (word & 0x1ff)*multiplier
+
+    def conversion_time(self):
+        f = self.frequency
+        settle = self.settle_cycles/f if f > 0 else 0
+        return settle + self.DFT_SAMPLES*16/self.clock
+
+    # -- conversions ---------------------------------------------------------
+    def _start_conversion(self):
+        self.registers[0x8f] &= 0b11111001
+        delay = self.conversion_time() if self.realtime else 0
+        self._ready_at = time.monotonic() + delay
+
+    def _update(self):
+        '''latch the result of a conversion that has had time to finish'''
+        if self._ready_at is None or time.monotonic() < self._ready_at:
+            return
+        self._ready_at = None
+        self.conversions += 1
+        control = self.registers[0x80]
+        scale = self.RANGE_SCALE[(control >> 1) & 0b11]
+        pga = 1 if control & 0b1 else 5
+        f = self.frequency
+        z = self.load(f) if f > 0 else complex('inf')
+        y = self.gain*scale*pga/z*cmath.exp(1j*self.system_phase)
+        for reg, value in ((0x94, y.real), (0x96, y.imag)):
+            if self.noise:
+                value += self._random.gauss(0, self.noise)
+            value = int(round(min(max(value, -32768), 32767)))
+            self.registers[reg:reg+2] = (value & 0xffff).to_bytes(2, 'big')
+        status = 0b010
+        if self._increments >= self.num_increments:
+            status |= 0b100
+        self.registers[0x8f] = (self.registers[0x8f] & 0b1) | status
+
+    def _command(self, mode):
+        if mode == 0b0001: # Initialize with start frequency
+            self._increments = 0
+            self._ready_at = None
+            self.registers[0x8f] = 0
+        elif mode == 0b0010: # Start frequency sweep
+            self._start_conversion()
+        elif mode == 0b0011: # Increment frequency
+            if self._increments < self.num_increments:
+                self._increments += 1
+            self._start_conversion()
+        elif mode == 0b0100: # Repeat frequency
+            self._start_conversion()
+        elif mode == 0b1001: # Measure temperature
+            self.registers[0x8f] |= 0b1
+        elif mode in (0b1010, 0b1011): # Power-down, Standby
+            self._ready_at = None
+            self.registers[0x8f] = 0
+
+    def _write_byte(self, reg, value):
+        self.registers[reg] = value
+        if reg == 0x80:
+            self._command(value >> 4)
+        elif reg == 0x81 and value & 0b00010000: # reset
+            self._ready_at = None
+            self._increments = 0
+            self.registers[0x8f] = 0
+
+    def _read_byte(self, reg):
+        self._update()
+        return self.registers[reg]
+
+    # -- bus interface (called by sim_bus) -----------------------------------
+    def write(self, data):
+        if not data:
+            return # address probe
+        cmd = data[0]
+        if cmd == 0b10110000: # set address pointer
+            self._pointer = data[1]
+        elif cmd == 0b10100001: # block read
+            self._block = data[1]
+        elif cmd == 0b10100000: # block write
+            for i, value in enumerate(data[2:2+data[1]]):
+                self._write_byte(self._pointer+i, value)
+        else: # register address, optionally followed by data
+            self._pointer = cmd
+            for i, value in enumerate(data[1:]):
+                self._write_byte(cmd+i, value)
+
+    def read(self, n):
+        if self._block:
+            n, self._block = self._block, 0
+            return bytes(self._read_byte(self._pointer+i) for i in range(n))
+        return bytes(self._read_byte(self._pointer) for _ in range(n))
+
+
+class sim_tca9543a():
+    '''
+    emulation of a TCA9543A I2C switch
+
+    Devices attached to a channel answer on the bus while that channel is
+    enabled. Two enabled devices at the same address collide, which is
+    reported as an I/O error.
+    '''
+    NUM_CH = 2
+
+    def __init__(self):
+        self.control = 0
+        self.channels = [{} for _ in range(self.NUM_CH)]
+
+    def attach(self, channel, address, device):
+        '''attach a simulated device at `address` behind `channel`'''
+        self.channels[channel][address] = device
+        return device
+
+    def route(self, address):
+        '''the enabled device at `address`, or None'''
+        found = [devices[address] for ch, devices in enumerate(self.channels)
+                 if self.control & (1 << ch) and address in devices]
+        if len(found) > 1:
+            raise OSError(errno.EIO, 'I2C address collision behind switch')
+        return found[0] if found else None
+
+    def write(self, data):
+        if data:
+            self.control = data[-1] & 0b11
+
+    def read(self, n):
+        return bytes([self.control])*n
+
+
+class sim_bus():
+    '''
+    stand-in for busio.I2C that routes transactions to simulated devices
+
+    Parameters
+    ----------
+    latency : float, optional
+        seconds added to every transaction, to model bus time (default is 0)
+    frequency : int, optional
+        nominal bus clock in Hz (default is 100000)
+    error_rate : float, optional
+        probability that a transfer goes wrong, to model a bus that is 
+        clocked too fast: half of the errors are a NACK (OSError), the others
+        flip one bit of the data written or read (default is 0)
+    seed : int, optional
+        seed for the injected errors
+    '''
+    def __init__(self, latency=0.0, frequency=100000, error_rate=0.0, 
+                 seed=None):
+        self.latency = latency
+        self.frequency = frequency
+        self.error_rate = error_rate
+        self.devices = {}
+        self.transactions = 0
+        self.injected = 0 # number of errors injected
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def attach(self, address, device):
+        '''attach a simulated device (with write(data) and read(n)) at address'''
+        self.devices[address] = device
+        return device
+
+    def _device(self, address):
+        device = self.devices.get(address)
+        if device is None:
+            # look behind any switches
+            for switch in self.devices.values():
+                if hasattr(switch, 'route'):
+                    device = switch.route(address)
+                    if device is not None:
+                        break
+        if device is None:
+            raise OSError(errno.EREMOTEIO, 'Remote I/O error')
+        self.transactions += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return device
+
+    def _transfer(self, data):
+        '''`data` as it arrives, possibly with an injected error'''
+        if not self.error_rate or self._random.random() >= self.error_rate:
+            return data
+        self.injected += 1
+        if not data or self._random.random() < 0.5:
+            raise OSError(errno.EIO, 'Input/output error')
+        data = bytearray(data)
+        bit = self._random.randrange(8*len(data))
+        data[bit//8] ^= 1 << bit%8
+        return bytes(data)
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        found = set(self.devices)
+        for switch in self.devices.values():
+            if hasattr(switch, 'route'):
+                found.update(address for address in range(0x80) 
+                             if switch.route(address) is not None)
+        return sorted(found)
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        device = self._device(address)
+        device.write(self._transfer(bytes(buffer[start:end])))
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        buffer[start:end] = self._transfer(self._device(address).read(
+                end-start))
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0,
+                              in_end=None):
+        device = self._device(address)
+        device.write(self._transfer(bytes(buffer_out[out_start:out_end])))
+        in_end = len(buffer_in) if in_end is None else in_end
+        buffer_in[in_start:in_end] = self._transfer(device.read(
+                in_end-in_start))
+
+    def deinit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+
+
+class I2CDevice():
+    '''
+    minimal adafruit_bus_device.i2c_device.I2CDevice, used when the Adafruit
+    libraries aren't installed
+    '''
+    def __init__(self, i2c, device_address, probe=True):
+        self.i2c = i2c
+        self.device_address = device_address
+        if probe:
+            with self:
+                try:
+                    self.i2c.writeto(device_address, b'')
+                except OSError:
+                    raise ValueError('No I2C device at address: 0x%x'
+                                     % device_address)
+
+    def readinto(self, buf, *, start=0, end=None):
+        self.i2c.readfrom_into(self.device_address, buf, start=start, end=end)
+
+    def write(self, buf, *, start=0, end=None):
+        self.i2c.writeto(self.device_address, buf, start=start, end=end)
+
+    def write_then_readinto(self, out_buffer, in_buffer, *, out_start=0,
+                            out_end=None, in_start=0, in_end=None):
+        self.i2c.writeto_then_readfrom(self.device_address, out_buffer,
+                                       in_buffer, out_start=out_start,
+                                       out_end=out_end, in_start=in_start,
+                                       in_end=in_end)
+
+    def __enter__(self):
+        while not self.i2c.try_lock():
+            time.sleep(0)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.i2c.unlock()
+        return False
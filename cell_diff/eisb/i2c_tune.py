@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+I2C bus clock tuning.
+
+tune tries increasing bus clocks and checks each device at each clock with
+register write-verify (a test pattern written to a register that is safe to
+change, read back and compared, then the original value restored) and
+read-back (a register compared with its value read at the slowest clock).
+The fastest clock with no errors in any trial, at which every slower clock
+tested was also clean, is chosen and can be saved per board. i2c_connect
+(labonscope) and ad5933 use the saved clock when none is given.
+
+    python3 i2c_tune.py            # tune the devices found on the Pi's bus
+
+Note that on Linux Blinka opens /dev/i2c-1, whose clock is set by the
+kernel (dtparam=i2c_arm_baudrate in /boot/config.txt) rather than by
+busio.I2C's frequency. There a tuning run measures the error rate at the
+configured clock, and the chosen value should be set in config.txt.
+"""
+import datetime
+import json
+import os
+import socket
+from collections import namedtuple
+
+# `address`, first `register` and number of registers (`width`); writable
+# probes are written with test patterns, the others only read back
+register_probe = namedtuple('register_probe',
+                            'address register width writable')
+
+# registers of the board's devices that are safe to test
+DEVICE_PROBES = {
+    # AD5933 start frequency (not used until the next Initialize) and
+    # control register (read only, it issues commands); the AD5933 only
+    # takes single byte writes without its block command
+    0x0d:(register_probe(0x0d, 0x82, 1, True),
+          register_probe(0x0d, 0x80, 1, False)),
+    # MCP23017 input polarity (no effect on outputs) and I/O direction
+    0x20:(register_probe(0x20, 0x02, 2, True),
+          register_probe(0x20, 0x00, 2, False)),
+    # MCP9600 device ID and revision
+    0x60:(register_probe(0x60, 0x20, 2, False),),
+    }
+FREQUENCIES = (10000, 50000, 100000, 200000, 400000, 1000000)
+PATTERNS = (0x55, 0xaa, 0x00, 0xff, 0x5a, 0xa5)
+TUNING_FILE = os.path.expanduser('~/.eisb_i2c.json')
+
+
+def _read(bus, probe):
+    out = bytearray([probe.register])
+    buf = bytearray(probe.width)
+    bus.writeto_then_readfrom(probe.address, out, buf)
+    return bytes(buf)
+
+
+def _write(bus, probe, values):
+    bus.writeto(probe.address, bytearray([probe.register]) + bytes(values))
+
+
+def run_trials(bus, probes, trials=100, reference=None):
+    '''
+    run_trials(bus, probes, trials=100, reference=None)
+
+    Checks every probe `trials` times on `bus`.
+
+    Parameters
+    ----------
+    bus : busio.I2C compatible bus
+    probes : iterable of register_probe
+    trials : int, optional
+    reference : dict, optional
+        {probe: bytes} expected contents of the read-only probes (default
+        is what the first read returns)
+
+    Returns
+    -------
+    dict
+        {'trials', 'errors', 'nacks', 'mismatches'} over all probes
+    '''
+    errors = nacks = 0
+    reference = {} if reference is None else reference
+    while not bus.try_lock():
+        pass
+    try:
+        for probe in probes:
+            try:
+                original = _read(bus, probe)
+            except OSError:
+                errors += trials
+                nacks += trials
+                continue
+            for i in range(trials):
+                try:
+                    if probe.writable:
+                        expected = bytes((PATTERNS[(i+k) % len(PATTERNS)]
+                                          for k in range(probe.width)))
+                        _write(bus, probe, expected)
+                    else:
+                        expected = reference.setdefault(probe, original)
+                    if _read(bus, probe) != expected:
+                        errors += 1
+                except OSError:
+                    errors += 1
+                    nacks += 1
+            if probe.writable:
+                # put the original value back, retrying on errors
+                for _ in range(10):
+                    try:
+                        _write(bus, probe, original)
+                        if _read(bus, probe) == original:
+                            break
+                    except OSError:
+                        pass
+    finally:
+        bus.unlock()
+    return {'trials':trials*len(probes), 'errors':errors, 'nacks':nacks,
+            'mismatches':errors-nacks}
+
+
+def tune(bus_factory, probes=None, frequencies=FREQUENCIES, trials=100):
+    '''
+    tune(bus_factory, probes=None, frequencies=FREQUENCIES, trials=100)
+
+    Finds the fastest reliable bus clock.
+
+    Parameters
+    ----------
+    bus_factory : callable
+        bus_factory(frequency) returns a busio.I2C compatible bus at that
+        clock, e.g. lambda f: busio.I2C(board.SCL, board.SDA, frequency=f);
+        it is deinit-ed after each clock
+    probes : iterable of register_probe, optional
+        default is the DEVICE_PROBES of the devices found by a scan at the
+        slowest clock
+    frequencies : iterable of int, optional
+        clocks to try in Hz (sorted, slowest first)
+    trials : int, optional
+        checks of each probe at each clock
+
+    Returns
+    -------
+    dict
+        'frequency' is the chosen clock (None if even the slowest had
+        errors) and 'results' the run_trials result per clock
+    '''
+    frequencies = sorted(frequencies)
+    reference = {}
+    results = {}
+    chosen = None
+    for frequency in frequencies:
+        bus = bus_factory(frequency)
+        try:
+            if probes is None:
+                while not bus.try_lock():
+                    pass
+                try:
+                    found = bus.scan()
+                finally:
+                    bus.unlock()
+                probes = [p for address in found
+                          for p in DEVICE_PROBES.get(address, ())]
+                if not probes:
+                    raise ValueError('no known devices found on the bus')
+            results[frequency] = run_trials(bus, probes, trials, reference)
+        finally:
+            bus.deinit()
+        if results[frequency]['errors']:
+            break # faster clocks won't be used anyway
+        chosen = frequency
+    return {'frequency':chosen, 'results':results,
+            'probes':[list(p) for p in probes]}
+
+
+def save_tuning(result, board=None, filename=TUNING_FILE):
+    '''
+    save_tuning(result, board=None, filename=TUNING_FILE)
+
+    Stores the result of tune for `board` (default is the host name) in the
+    JSON file `filename`, next to the results of other boards.
+    '''
+    board = socket.gethostname() if board is None else board
+    saved = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            saved = json.load(f)
+    saved[board] = {'frequency':result['frequency'],
+                    'timestamp':str(datetime.datetime.now()),
+                    'results':{str(k):v for k, v in result['results'].items()}}
+    with open(filename, 'w') as f:
+        json.dump(saved, f, indent=2)
+
+
+def tuned_frequency(default=None, board=None, filename=TUNING_FILE):
+    '''
+    tuned_frequency(default=None, board=None, filename=TUNING_FILE)
+
+    Returns the bus clock saved for `board` (default is the host name), or
+    `default` if there is none.
+    '''
+    board = socket.gethostname() if board is None else board
+    try:
+        with open(filename) as f:
+            frequency = json.load(f)[board]['frequency']
+    except (OSError, ValueError, KeyError):
+        return default
+    return default if frequency is None else frequency
+
+
+if __name__ == '__main__':
+    import argparse
+    import board, busio
+    parser = argparse.ArgumentParser(description='Tune the I2C bus clock.')
+    parser.add_argument('-n', '--trials', type=int, default=100)
+    parser.add_argument('-f', '--frequencies', type=int, nargs='+',
+                        default=FREQUENCIES)
+    parser.add_argument('--dry-run', action='store_true',
+                        help="don't save the result")
+    args = parser.parse_args()
+    result = tune(lambda f: busio.I2C(board.SCL, board.SDA, frequency=f),
+                  frequencies=args.frequencies, trials=args.trials)
+    for frequency, trial in result['results'].items():
+        print('{:8d} Hz: {errors} errors in {trials} trials ({nacks} NACKs, '
+              '{mismatches} mismatches)'.format(frequency, **trial))
+    print('fastest reliable clock: {} Hz'.format(result['frequency']))
+    if not args.dry_run and result['frequency'] is not None:
+        save_tuning(result)
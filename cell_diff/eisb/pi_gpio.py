@@ -4,7 +4,17 @@ Created on Thu Jul 11 11:26:16 2019
 
 @author: joeld
 """
-import board, digitalio
+import time
+from collections import namedtuple
+import numpy as np
+try:
+    import board, digitalio
+except ImportError: # not on a Pi, pins are simulated (see sim_pin)
+    board = digitalio = None
+
+# frequencies[index] all use `divider`, `code` is the pair of BCD digit bit 
+# lists from calc_clock_divide (None when the divider is bypassed)
+divider_band = namedtuple('divider_band', 'divider code index')
 
 
 def digit_to_4bit(d):
@@ -27,12 +37,48 @@ def calc_clock_divide(N, mode=2):
     return d0,d1 
 
 def clock_divide_N(freq):
-    for f,n in reversed(pi_gpio.freq_limits):
-        if freq < f: return n
-    else: return 1
+    '''
+    clock divider to use at `freq` (see pi_gpio.freq_limits), 1 meaning no
+    division; `freq` can also be an array, giving an array of dividers
+    '''
+    limits = sorted(pi_gpio.freq_limits)
+    thresholds = [f for f,n in limits]
+    dividers = np.array([n for f,n in limits] + [1])
+    N = dividers[np.searchsorted(thresholds, freq, side='right')]
+    return int(N) if np.ndim(N) == 0 else N
+
+def divider_bands(freqs):
+    '''
+    divider_bands(freqs)
+    
+    Groups frequencies by clock divider.
+    
+    Returns
+    -------
+    list of divider_band
+        one per divider in use, in order of increasing frequency
+    '''
+    freqs = np.asarray(freqs, dtype=float)
+    N = clock_divide_N(freqs)
+    bands = []
+    for n in sorted(set(np.atleast_1d(N).tolist()), reverse=True):
+        code = calc_clock_divide(n) if n > 1 else None
+        bands.append(divider_band(n, code, np.flatnonzero(N == n)))
+    return bands
     
+class sim_pin():
+    '''stand-in for digitalio.DigitalInOut when running without a Pi'''
+    def __init__(self, name):
+        self.name = name
+        self.value = False
+    def deinit(self):
+        pass
+
 def config_output_pin(assignment):
-    pin = digitalio.DigitalInOut(assignment)
+    '''assignment is a board pin name, e.g. "D7"'''
+    if digitalio is None:
+        return sim_pin(assignment)
+    pin = digitalio.DigitalInOut(getattr(board, assignment))
     pin.direction = digitalio.Direction.OUTPUT
     pin.drive_mode = digitalio.DriveMode.PUSH_PULL
     pin.value = False
@@ -43,25 +89,38 @@ class pi_gpio():
     wrapper for Rasberry Pi 3B+ GPIO interactions with all digital logic 
     components on the EIS board (v3.2)
     '''
-    CLK_DIV = board.D7
+    CLK_DIV = 'D7'
 
-    CLK_PINS = ((5, board.D5),
-                (6, board.D6),
-                (7, board.D12),
-                (8, board.D13),
-                (9, board.D19),
-                (10,board.D16),
-                (11,board.D26),
-                (12,board.D20))
+    CLK_PINS = ((5, 'D5'),
+                (6, 'D6'),
+                (7, 'D12'),
+                (8, 'D13'),
+                (9, 'D19'),
+                (10,'D16'),
+                (11,'D26'),
+                (12,'D20'))
     
     # AD5933 is inaccurate at low frequencies - see UG-364
     # [(low_limit, clock_div),...]
     freq_limits = [(10e3,4),(5e3,4),(1e3,8),(300,16),(200,32)]
     
 
+    # time for a new divider setting to reach the AD5933: GPIO write and 
+    # logic propagation, plus a few periods of the divided clock
+    SETTLE_MARGIN = 0.002 # s
+    SETTLE_CLOCKS = 16 # periods of the divided clock
+    
     def __init__(self, **kwargs):
         self.j_clk = {} # holds the pins controlling the frequency divider
         self.setup_GPIO()
+        # the pins are known to be low after setup, so the divider state can
+        # be cached and writes that wouldn't change anything skipped
+        self._pin_values = {i:False for i in self.j_clk}
+        self.divider = None # N last programmed with set_clock_divide
+        self.divider_mode = None # and the mode its digits were coded for
+        self.divider_enabled = False
+        self._changed_at = None # time.monotonic() of the last clock change
+        self.pin_writes = 0
     
     def setup_GPIO(self):
         '''configure GPIO pins and set default values'''
@@ -84,16 +143,62 @@ class pi_gpio():
         For board v3.2:
         Mode is set by jumpers on the board (J1-J3) these determine KA-KC.
         KA-KC are tied to Vdd, so the mode is fixed at 2. 
+        
+        Only pins that change are written. Returns True if the divider
+        setting (N or mode) changed.
         '''
+        if (N, mode) == (self.divider, self.divider_mode):
+            return False
         d0,d1 = calc_clock_divide(N,mode)        
         for i,b in enumerate(d0):
-                self.j_clk[i+9].value = b
+                self._write_clk_pin(i+9, b)
         for i,b in enumerate(d1):
-                self.j_clk[i+5].value =  b
+                self._write_clk_pin(i+5, b)
+        self.divider, self.divider_mode = N, mode
+        if self.divider_enabled:
+            self._changed_at = time.monotonic()
+        return True
+    
+    def _write_clk_pin(self, i, b):
+        if self._pin_values[i] != bool(b):
+            self.j_clk[i].value = b
+            self._pin_values[i] = bool(b)
+            self.pin_writes += 1
     
     def enable_clock_divider(self):
-        self.clk_div.value = True
+        if not self.divider_enabled:
+            self.clk_div.value = True
+            self.divider_enabled = True
+            self._changed_at = time.monotonic()
+            self.pin_writes += 1
     def disable_clock_divider(self):
-        self.clk_div.value = False
+        if self.divider_enabled:
+            self.clk_div.value = False
+            self.divider_enabled = False
+            self._changed_at = time.monotonic()
+            self.pin_writes += 1
+            
+    @property
+    def clock_divide(self):
+        '''divider currently applied to the AD5933 clock (1 if bypassed)'''
+        return self.divider if self.divider_enabled else 1
+    
+    def settle_time(self, N, mclk=16e6):
+        '''seconds for a change to divider `N` to reach the AD5933'''
+        return self.SETTLE_MARGIN + self.SETTLE_CLOCKS*N/mclk
+    
+    def wait_settled(self, mclk=16e6):
+        '''
+        wait_settled(mclk=16e6)
+        
+        Sleeps until the last divider change has settled (see settle_time), 
+        which is no time at all if nothing changed recently.
+        '''
+        if self._changed_at is None:
+            return
+        done = self._changed_at + self.settle_time(self.clock_divide, mclk)
+        delay = done - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
     
 
@@ -16,8 +16,9 @@ def main(argv):
     run_save_continuous_sweeps.py - runs a test for save_continuous_sweeps function
     takes command line args, name, dest
     
-    name - str, name of the file to be saved in the format...
-        name_dat_<CHANNEL NUMBER>.txt
+    name - str, name of the files to be saved in the format...
+        name_ch<CHANNEL NUMBER>_<SWEEP NUMBER>.txt
+        (eis_board(binary=True) saves .eisb files instead)
         
     dest - str, file directory where the data file is to be saved
     
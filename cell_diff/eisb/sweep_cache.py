@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Cached, process-parallel loading of sweep files for analysis.
+
+load_all returns eis_reader.read_eis_to_array for many files. The reduced
+array of each file (and its metadata) is kept in a sidecar file in a
+CACHE_DIR subdirectory next to it, keyed by the file's size and mtime, so an
+unchanged directory is loaded from the sidecars without parsing anything.
+Files without a valid sidecar are parsed on a process pool.
+
+A sidecar is a .npy file of the array (np.save without pickles) and a .json
+file with the key, the file's metadata and where the records start in the
+.npy: data directories are shared and copied around, so nothing in them may
+be able to run code when it's loaded. The records are read directly with
+ARRAY_DTYPE, which the key fixes, since parsing the .npy header would take
+about as long as parsing a short text sweep. The array is replaced before
+the JSON file, which a reader checks first.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from eis_reader import read_eis_to_array, ARRAY_DTYPE
+
+CACHE_DIR = '.eis_cache'
+# below this many files to parse, starting a pool costs more than it saves
+MIN_PARALLEL = 8
+# ARRAY_DTYPE.descr as it comes out of a JSON round trip
+_DESCR = json.loads(json.dumps(ARRAY_DTYPE.descr))
+
+
+def sidecar_path(filepath):
+    '''the cache files of `filepath`, without the .npy/.json extension'''
+    directory, name = os.path.split(os.path.abspath(filepath))
+    return os.path.join(directory, CACHE_DIR, name)
+
+
+def _key(filepath, sweep):
+    # sidecars written for another reduction (e.g. different fields) are
+    # stale too; as a list, like it comes out of the JSON file
+    st = os.stat(filepath)
+    return [st.st_size, st.st_mtime_ns, bool(sweep), _DESCR]
+
+
+def read_cached(filepath, sweep=True):
+    '''
+    Returns (metadata, data) from the sidecar of `filepath`, or None if
+    there is no sidecar or it doesn't match the file anymore.
+    '''
+    path = sidecar_path(filepath)
+    try:
+        key = _key(filepath, sweep)
+        with open(path + '.json') as f:
+            header = json.load(f)
+        if header['key'] != key:
+            return None
+        count = header['records']
+        data = np.fromfile(path + '.npy', ARRAY_DTYPE, count=count,
+                           offset=header['offset'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if len(data) != count:
+        return None
+    return header['metadata'], data
+
+
+def write_cached(filepath, metadata, data, sweep=True, key=None):
+    '''
+    store `data` as the sidecar of `filepath` (ignored if read-only), under
+    `key` if given: the _key of the file taken before it was read, so a file
+    that changed while it was parsed isn't cached with its new size and mtime
+    '''
+    path = sidecar_path(filepath)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        key = _key(filepath, sweep) if key is None else key
+        # written under other names first so readers never see half a file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        data = np.ascontiguousarray(data, ARRAY_DTYPE)
+        with open(tmp, 'wb') as f:
+            np.save(f, data, allow_pickle=False)
+            offset = f.tell() - data.nbytes
+        os.replace(tmp, path + '.npy')
+        with open(tmp, 'w') as f:
+            json.dump({'key':key, 'metadata':metadata, 'records':len(data),
+                       'offset':offset}, f)
+        os.replace(tmp, path + '.json')
+    except (OSError, TypeError, ValueError): # read-only, or not JSON metadata
+        pass
+
+
+def load(filepath, sweep=True, cache=True):
+    '''
+    load(filepath, sweep=True, cache=True)
+
+    eis_reader.read_eis_to_array(filepath, sweep), from and to the sidecar
+    cache if `cache`.
+    '''
+    if cache:
+        cached = read_cached(filepath, sweep)
+        if cached is not None:
+            return cached
+    return _parse((filepath, sweep, cache))
+
+
+def _parse(args):
+    '''parse (and cache) a file that isn't cached'''
+    filepath, sweep, cache = args
+    key = None
+    if cache:
+        try:
+            key = _key(filepath, sweep)
+        except OSError:
+            cache = False # read_eis_to_array reports it
+    metadata, data = read_eis_to_array(filepath, sweep)
+    if cache:
+        write_cached(filepath, metadata, data, sweep, key)
+    return metadata, data
+
+
+def load_all(filepaths, sweep=True, cache=True, processes=None):
+    '''
+    load_all(filepaths, sweep=True, cache=True, processes=None)
+
+    Loads many sweep files (see load), parsing the ones that aren't cached
+    on `processes` worker processes (default is one per CPU).
+
+    Returns
+    -------
+    list
+        (metadata, data) of each file, in the order of `filepaths`
+    '''
+    filepaths = list(filepaths)
+    results = [read_cached(f, sweep) if cache else None for f in filepaths]
+    missing = [i for i, r in enumerate(results) if r is None]
+    jobs = [(filepaths[i], sweep, cache) for i in missing]
+    if len(jobs) < MIN_PARALLEL or processes == 1:
+        loaded = map(_parse, jobs)
+    else:
+        workers = processes or os.cpu_count() or 1
+        # a few chunks per worker balances the load at little IPC cost
+        chunksize = max(1, len(jobs)//(4*workers))
+        with ProcessPoolExecutor(workers) as pool:
+            loaded = list(pool.map(_parse, jobs, chunksize=chunksize))
+    for i, result in zip(missing, loaded):
+        results[i] = result
+    return results
+
+
+def clear_cache(directory):
+    '''delete the sidecars of the files in `directory`'''
+    cache = os.path.join(directory, CACHE_DIR)
+    if not os.path.isdir(cache):
+        return
+    for name in os.listdir(cache):
+        os.remove(os.path.join(cache, name))
+    os.rmdir(cache)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Storage for frequency sweep results as they are acquired.
+
+Points are written into a preallocated NumPy structured array so that the
+acquisition loop doesn't build Python lists, and consumers (file writers, the
+server, analysis) read views of the same memory instead of copies.
+"""
+import time
+import numpy as np
+
+# one record per measurement: time since sweep start (s), frequency (Hz), and
+# the raw real and imaginary DFT values
+SWEEP_DTYPE = np.dtype([('T','<f8'), ('F','<f8'), ('R','<i4'), ('I','<i4')])
+# with calibration applied on the fly (see calibration.calibration_table),
+# each record also carries |Z| in ohms and the calibrated phase in radians
+CAL_SWEEP_DTYPE = np.dtype(SWEEP_DTYPE.descr + [('M','<f8'), ('P','<f8')])
+# one record per frequency of a sweep with repeats: mean time and frequency,
+# mean and standard deviation of real and imaginary, and number of repeats
+STATS_DTYPE = np.dtype([('T','<f8'), ('F','<f8'), ('R','<f8'), ('I','<f8'),
+                        ('SR','<f8'), ('SI','<f8'), ('N','<i4')])
+# with calibration, |Z| and phase of the mean real and imaginary
+CAL_STATS_DTYPE = np.dtype(STATS_DTYPE.descr + [('M','<f8'), ('P','<f8')])
+
+
+class sweep_buffer():
+    '''
+    Preallocated, append-only container for the points of a sweep.
+
+    The buffer is sized up front (normally number of frequencies * repeats)
+    and only grows (by doubling) if more points arrive than expected.
+
+    Parameters
+    ----------
+    capacity : int
+        number of points to preallocate
+    dtype : numpy.dtype, optional
+        record layout (default is SWEEP_DTYPE: T, F, R, I)
+    '''
+    def __init__(self, capacity, dtype=SWEEP_DTYPE):
+        self._data = np.zeros(max(int(capacity), 1), dtype=dtype)
+        self._n = 0
+
+    @classmethod
+    def wrap(cls, array):
+        '''a full buffer holding the points of `array` (not copied)'''
+        buffer = cls.__new__(cls)
+        buffer._data = array
+        buffer._n = len(array)
+        return buffer
+
+    def append(self, *point):
+        '''append one point, given as one value per field'''
+        if self._n == len(self._data):
+            self._grow()
+        self._data[self._n] = point
+        self._n += 1
+
+    def _grow(self):
+        # views taken before growing keep pointing at the old (still valid)
+        # memory, they just don't see the new points
+        grown = np.zeros(2*len(self._data), dtype=self._data.dtype)
+        grown[:self._n] = self._data[:self._n]
+        self._data = grown
+
+    @property
+    def data(self):
+        '''zero-copy view of the acquired points'''
+        return self._data[:self._n]
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def latest(self):
+        '''the most recent point, or None if the buffer is empty'''
+        return self._data[self._n-1] if self._n else None
+
+    def clear(self):
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+
+class running_stats():
+    '''
+    Running mean and variance of the real and imaginary values measured at
+    one frequency (Welford's algorithm), so repeats can be summarised and
+    stopped early without keeping them.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.n = 0
+        self.t = 0.0 # mean time
+        self.real = self.imag = 0.0 # means
+        self._m2_real = self._m2_imag = 0.0 # sums of squared deviations
+
+    def add(self, t, real, imag):
+        self.n += 1
+        self.t += (t - self.t)/self.n
+        delta = real - self.real
+        self.real += delta/self.n
+        self._m2_real += delta*(real - self.real)
+        delta = imag - self.imag
+        self.imag += delta/self.n
+        self._m2_imag += delta*(imag - self.imag)
+
+    @property
+    def std_real(self):
+        return (self._m2_real/(self.n-1))**0.5 if self.n > 1 else 0.0
+
+    @property
+    def std_imag(self):
+        return (self._m2_imag/(self.n-1))**0.5 if self.n > 1 else 0.0
+
+    def sem(self):
+        '''larger of the standard errors of the real and imaginary means'''
+        if self.n < 2:
+            return float('inf')
+        return max(self.std_real, self.std_imag)/self.n**0.5
+
+    def record(self, f):
+        '''the summary as a STATS_DTYPE record (tuple) at frequency `f`'''
+        return (self.t, f, self.real, self.imag, self.std_real, 
+                self.std_imag, self.n)
+
+
+def print_point(*point):
+    print(', '.join(str(x) for x in point))
+
+
+class point_reporter():
+    '''
+    Rate-limited per-point hook for the acquisition loop.
+
+    Calls `hook(t, f, r, i)` (or `hook(t, f, r, i, m, p)` for calibrated
+    sweeps) for at most one point every `interval` seconds so that reporting 
+    (e.g. printing to a terminal) can't add jitter to every point of a sweep.
+
+    Parameters
+    ----------
+    hook : callable, optional
+        called with the fields of a point (default is print_point)
+    interval : float, optional
+        minimum number of seconds between calls (default is 1.0)
+    '''
+    def __init__(self, hook=print_point, interval=1.0):
+        self.hook = hook
+        self.interval = interval
+        self._next = 0.0
+
+    def __call__(self, *point):
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            self.hook(*point)
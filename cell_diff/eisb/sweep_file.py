@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only binary sweep files.
+
+A sweep file is a fixed size header followed by fixed size little-endian
+records in the layout of sweep_data.SWEEP_DTYPE (T, F, R, I), or of
+sweep_data.CAL_SWEEP_DTYPE (T, F, R, I, M, P) for sweeps that were calibrated
+while they were acquired (flagged in the header). Records can be
+appended as they are acquired and the record block can be memory-mapped for
+reading, so nothing has to be parsed. to_text converts a sweep file into the
+original text format (metadata line, blank line, "T,F,R,I", one row per
+point) for existing tools.
+
+Header layout (128 bytes, little-endian)
+----------------------------------------
+    4s   magic b'EISB'
+    H    format version
+    H    header size in bytes
+    H    record size in bytes
+    B    flags (bit 0: records include calibrated M and P)
+    B    output range code (see ad5933.OUTPUT_RANGES)
+    B    PGA gain
+    B    external clock
+    H    settling cycles
+    d    clock frequency in Hz
+    16s  driver code version (ASCII)
+    32s  timestamp (ISO format, ASCII)
+    ...  zero padding
+"""
+import datetime
+import struct
+import sys
+import numpy as np
+
+from sweep_data import SWEEP_DTYPE, CAL_SWEEP_DTYPE
+
+MAGIC = b'EISB'
+VERSION = 1
+EXTENSION = '.eisb'
+HEADER_SIZE = 128
+_HEADER = struct.Struct('<4sHHHBBBBHd16s32s')
+FLAG_CALIBRATED = 0b1
+
+# metadata keys, in the order (and with the names) of the text format
+TEXT_KEYS = ('output range', 'pga_gain', 'external_clock', 'settle_cycles',
+             'code version', 'timestamp')
+
+
+def pack_header(metadata, dtype=SWEEP_DTYPE):
+    '''
+    pack_header(metadata, dtype=SWEEP_DTYPE)
+
+    Parameters
+    ----------
+    metadata : dict
+        as returned by ad5933.file_metadata (keys of TEXT_KEYS plus
+        'clock_freq'); a missing timestamp is set to the current time
+    dtype : numpy.dtype, optional
+        record layout, SWEEP_DTYPE or CAL_SWEEP_DTYPE
+
+    Returns
+    -------
+    bytes
+        the HEADER_SIZE byte file header
+    '''
+    timestamp = metadata.get('timestamp') or str(datetime.datetime.now())
+    flags = FLAG_CALIBRATED if dtype == CAL_SWEEP_DTYPE else 0
+    header = _HEADER.pack(MAGIC, VERSION, HEADER_SIZE, dtype.itemsize, flags,
+                          int(metadata['output range']),
+                          int(metadata['pga_gain']),
+                          bool(metadata['external_clock']),
+                          int(metadata['settle_cycles']),
+                          float(metadata.get('clock_freq', 0)),
+                          str(metadata['code version']).encode('ascii'),
+                          str(timestamp).encode('ascii'))
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def unpack_header(header):
+    '''
+    unpack_header(header)
+
+    Returns
+    -------
+    dict
+        metadata with the same keys and (string) values as eis_reader.read_eis
+        returns for text files, plus 'clock_freq', 'format version',
+        'header size', and 'calibrated'
+    '''
+    (magic, version, header_size, record_size, flags, output_range, pga,
+     ext_clock, settle, clock, code_version, timestamp) = \
+        _HEADER.unpack_from(header)
+    if magic != MAGIC:
+        raise ValueError('not a sweep file')
+    if version > VERSION or record_size != _dtype(flags).itemsize:
+        raise ValueError('unsupported sweep file version {} ({} byte '
+                         'records)'.format(version, record_size))
+    values = (output_range, pga, bool(ext_clock), settle,
+              code_version.rstrip(b'\0').decode('ascii'),
+              timestamp.rstrip(b'\0').decode('ascii'))
+    metadata = {key:str(value) for key, value in zip(TEXT_KEYS, values)}
+    metadata['clock_freq'] = str(clock)
+    metadata['format version'] = str(version)
+    metadata['header size'] = str(header_size)
+    metadata['calibrated'] = str(bool(flags & FLAG_CALIBRATED))
+    return metadata
+
+
+def _dtype(flags):
+    return CAL_SWEEP_DTYPE if flags & FLAG_CALIBRATED else SWEEP_DTYPE
+
+
+def _record_dtype(records):
+    '''file layout for `records`, calibrated if they have an 'M' field'''
+    names = getattr(getattr(records, 'dtype', None), 'names', None) or ()
+    return CAL_SWEEP_DTYPE if 'M' in names else SWEEP_DTYPE
+
+
+def file_dtype(metadata):
+    '''record layout of a file, from its unpacked header'''
+    if metadata.get('calibrated') == 'True':
+        return CAL_SWEEP_DTYPE
+    return SWEEP_DTYPE
+
+
+def is_sweep_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def create(filename, metadata, dtype=SWEEP_DTYPE):
+    '''create (or truncate) `filename` as a sweep file with no records'''
+    with open(filename, 'wb') as f:
+        f.write(pack_header(metadata, dtype))
+
+
+def append(filename, records):
+    '''
+    append(filename, records)
+
+    Appends `records` (an array in the file's record layout or anything 
+    convertible to one) to an existing sweep file. Arrays already in that
+    layout, like sweep buffer views, are written without copying.
+    '''
+    with open(filename, 'rb') as f:
+        dtype = file_dtype(unpack_header(f.read(HEADER_SIZE)))
+    records = np.ascontiguousarray(records, dtype=dtype)
+    with open(filename, 'ab') as f:
+        records.tofile(f)
+
+
+def write(filename, records, metadata):
+    '''write a complete sweep file (calibrated if `records` has M and P)'''
+    dtype = _record_dtype(records)
+    records = np.ascontiguousarray(records, dtype=dtype)
+    with open(filename, 'wb') as f:
+        f.write(pack_header(metadata, dtype))
+        records.tofile(f)
+
+
+def read(filename, mmap=True):
+    '''
+    read(filename, mmap=True)
+
+    Returns
+    -------
+    metadata : dict
+        see unpack_header
+    records : numpy structured array (SWEEP_DTYPE or CAL_SWEEP_DTYPE)
+        memory-mapped (read only) unless `mmap` is False
+    '''
+    with open(filename, 'rb') as f:
+        metadata = unpack_header(f.read(HEADER_SIZE))
+        dtype = file_dtype(metadata)
+        offset = int(metadata['header size'])
+        if not mmap:
+            f.seek(offset)
+            return metadata, np.fromfile(f, dtype=dtype)
+        f.seek(0, 2)
+        count = (f.tell() - offset)//dtype.itemsize
+    if count == 0: # numpy can't map an empty region
+        return metadata, np.zeros(0, dtype=dtype)
+    return metadata, np.memmap(filename, dtype=dtype, mode='r',
+                               offset=offset, shape=(count,))
+
+
+def format_metadata(metadata):
+    '''the metadata line of the text format'''
+    return ('output range: {}, pga_gain: {}, external_clock: {}, '
+            'settle_cycles: {}, code version: {}, timestamp: {}').format(
+                *[metadata[key] for key in TEXT_KEYS])
+
+
+def write_text(filename, records, metadata):
+    '''write records and metadata in the original text format'''
+    with open(filename, 'w') as f:
+        f.write(format_metadata(metadata))
+        f.write('\n\n')
+        f.write(','.join(_record_dtype(records).names) + '\n')
+        for d in records:
+            line = ','.join(['{}'.format(x) for x in d]) + '\n'
+            f.write(line)
+
+
+def save(filename, records, metadata):
+    '''
+    save(filename, records, metadata)
+
+    Writes a binary sweep file if `filename` ends in EXTENSION, otherwise a 
+    text file.
+    '''
+    if filename.endswith(EXTENSION):
+        write(filename, records, metadata)
+    else:
+        write_text(filename, records, metadata)
+
+
+def to_text(filename, text_filename=None):
+    '''
+    to_text(filename, text_filename=None)
+
+    Converts a sweep file to the text format, by default next to the original
+    with a .txt extension. Returns the name of the text file.
+    '''
+    if text_filename is None:
+        base = filename[:-len(EXTENSION)] if filename.endswith(EXTENSION) \
+            else filename
+        text_filename = base + '.txt'
+    metadata, records = read(filename)
+    write_text(text_filename, records, metadata)
+    return text_filename
+
+
+if __name__ == '__main__':
+    # python sweep_file.py sweep.eisb [sweep.txt]
+    print(to_text(*sys.argv[1:3]))
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Plans arbitrary frequency lists as a small number of AD5933 hardware sweeps.
+
+The AD5933 can only sweep linearly (start, step, number of increments), and
+every sweep costs a Standby/Initialize/Start sequence with a settling delay.
+plan_segments splits a list of requested frequencies into linear segments
+whose points are all within a relative tolerance of the requested frequencies,
+without mixing clock divider bands in a segment. A segment either has one
+point per requested frequency (least squares fit) or is a finer grid whose
+unused points are dropped, whichever is cheaper; the split minimises the
+estimated total sweep time. Every increment costs bus traffic (status polls,
+data reads, commands) whether its point is kept or not, so a grid may have
+at most max_grid_ratio increments per requested frequency: past that extra
+segments are used even where a dense grid would be slightly faster.
+"""
+from collections import namedtuple
+import math
+import numpy as np
+
+from pi_gpio import clock_divide_N
+
+# start and step are excitation frequencies in Hz (i.e. before being
+# multiplied by `divider` for programming). freqs[n] is measured by grid
+# point points[n], which is at start + points[n]*step.
+sweep_segment = namedtuple('sweep_segment',
+                           'divider start step num_increments freqs points')
+
+
+def _fit(freqs):
+    '''least squares line through freqs[k] vs k, as (start, step, k)'''
+    n = len(freqs)
+    if n == 1:
+        return freqs[0], 0.0, np.zeros(1, dtype=int)
+    k = np.arange(n)
+    # closed form of np.polyfit(k, freqs, 1), which is much slower for the
+    # many short fits of plan_band
+    dk = k - (n-1)/2
+    step = np.dot(dk, freqs)/np.dot(dk, dk)
+    start = np.mean(freqs) - step*(n-1)/2
+    return start, step, k
+
+
+def _grid(freqs, tol, max_increments):
+    '''coarsest uniform grid from freqs[0] to freqs[-1] that has a distinct
+    point within tol of every frequency, or None'''
+    n = len(freqs)
+    span = freqs[-1] - freqs[0]
+    count = max(n-1, math.ceil(span/(2*tol*freqs[0])))
+    for count in (count, math.ceil(span/np.min(np.diff(freqs)))):
+        if count > max_increments:
+            return None
+        step = span/count
+        k = np.rint((freqs - freqs[0])/step).astype(int)
+        if np.all(np.diff(k) > 0):
+            return freqs[0], step, k
+    return None
+
+
+def _segment(freqs, divider, tol, max_increments, setup_time, point_time,
+             max_grid_ratio=math.inf):
+    '''
+    cheapest segment covering all of freqs, as (cost, segment), None if no
+    segment can cover them, or (inf, None) if only grids denser than
+    max_grid_ratio can
+    '''
+    options = []
+    if len(freqs) <= max_increments + 1:
+        options.append(_fit(freqs))
+    if len(freqs) > 2:
+        options.append(_grid(freqs, tol, max_increments))
+    best = None
+    for option in options:
+        if option is None:
+            continue
+        start, step, k = option
+        swept = start + step*k
+        if len(freqs) > 1 and (step <= 0 or
+                               np.max(np.abs(swept - freqs)/freqs) > tol):
+            continue
+        if k[-1] > max(len(freqs)-1, max_grid_ratio*len(freqs)):
+            best = best or (math.inf, None)
+            continue
+        grid = start + step*np.arange(k[-1]+1)
+        cost = setup_time + np.sum(np.broadcast_to(point_time(grid, divider),
+                                                   grid.shape))
+        if best is None or cost < best[0]:
+            best = (cost, sweep_segment(divider, start, step, int(k[-1]),
+                                        freqs, k))
+    return best
+
+
+def plan_band(freqs, divider, tol=0.01, max_increments=511, setup_time=1.0,
+              point_time=lambda f, divider: 0.05, point_overhead=0.0,
+              max_grid_ratio=4):
+    '''
+    plan_band(freqs, divider, tol=0.01, max_increments=511, setup_time=1.0,
+              point_time=lambda f, divider: 0.05, point_overhead=0.0,
+              max_grid_ratio=4)
+
+    Splits sorted `freqs` (all in one clock divider band) into the segments
+    with the lowest total estimated time (see plan_segments).
+
+    Returns
+    -------
+    list of sweep_segment
+    '''
+    n = len(freqs)
+    if point_overhead:
+        measure = point_time
+        point_time = lambda f, divider: measure(f, divider) + point_overhead
+    # best[j] is the cheapest (cost, segments) plan for freqs[:j]
+    best = [(0.0, [])] + [None]*n
+    # a segment measures a point within tol of each of its frequencies, so
+    # it costs at least setup_time plus their point times/(1+tol) (as long
+    # as point times don't fall faster than 1/f), which skips most segments
+    # that can't improve on the best plan found so far
+    measured = np.concatenate(([0.0], np.cumsum(np.broadcast_to(
+            point_time(freqs, divider), freqs.shape))))/(1+tol)
+    for j in range(1, n+1):
+        # longest segment last: once freqs[i:j] can't be swept in one
+        # segment (too many increments, or not within tol of a line) no
+        # longer segment can, which stops the search after the few
+        # segments that are feasible
+        for i in range(j-1, max(0, j-max_increments-1)-1, -1):
+            if best[i] is not None and best[j] is not None and \
+                    best[i][0] + setup_time + measured[j] - measured[i] >= \
+                    best[j][0]:
+                continue
+            option = _segment(freqs[i:j], divider, tol, max_increments,
+                              setup_time, point_time, max_grid_ratio)
+            if option is None:
+                break
+            if best[i] is None or option[1] is None:
+                continue
+            cost = best[i][0] + option[0]
+            if best[j] is None or cost < best[j][0]:
+                best[j] = (cost, best[i][1] + [option[1]])
+    return best[n][1]
+
+
+def plan_segments(freqs, tol=0.01, max_increments=511, divider=clock_divide_N,
+                  setup_time=1.0, point_time=lambda f, divider: 0.05,
+                  point_overhead=0.0, max_grid_ratio=4):
+    '''
+    plan_segments(freqs, tol=0.01, max_increments=511, divider=clock_divide_N,
+                  setup_time=1.0, point_time=lambda f, divider: 0.05,
+                  point_overhead=0.0, max_grid_ratio=4)
+
+    Turns a list of frequencies into linear hardware sweeps.
+
+    Parameters
+    ----------
+    freqs : array_like
+        requested frequencies in Hz (duplicates are dropped, order doesn't
+        matter)
+    tol : float, optional
+        maximum relative error between a swept and a requested frequency
+        (default is 0.01)
+    max_increments : int, optional
+        maximum number of increments per sweep (default is 511, the limit of
+        the AD5933)
+    divider : callable, optional
+        maps a frequency to its clock divider (default is
+        pi_gpio.clock_divide_N)
+    setup_time : float, optional
+        estimated seconds to start a sweep, mostly the settling delay after
+        Initialize (default is 1.0, ad5933.frequency_sweep's init_delay)
+    point_time : callable, optional
+        estimated seconds to measure one point (including repeats) given
+        an array of excitation frequencies and the clock divider (default is
+        0.05 s)
+    point_overhead : float, optional
+        estimated seconds of bus traffic per point (including repeats), 
+        paid for every increment of a segment, kept or not (default is 0,
+        see ad5933.point_overhead)
+    max_grid_ratio : float, optional
+        maximum increments of a segment per requested frequency it covers
+        (default is 4)
+
+    Returns
+    -------
+    list of sweep_segment
+        segments in order of increasing frequency
+    '''
+    freqs = np.unique(np.asarray(freqs, dtype=float))
+    if divider is clock_divide_N:
+        dividers = clock_divide_N(freqs) # vectorised
+    else:
+        dividers = np.array([divider(f) for f in freqs])
+    segments = []
+    # bands are contiguous in sorted order
+    edges = np.flatnonzero(np.diff(dividers)) + 1
+    for band in np.split(np.arange(len(freqs)), edges):
+        if len(band):
+            segments += plan_band(freqs[band], int(dividers[band[0]]), tol,
+                                  max_increments, setup_time, point_time,
+                                  point_overhead, max_grid_ratio)
+    return segments
+
+
+def select_requested(segment, data):
+    '''
+    select_requested(segment, data)
+
+    Drops the points of a sweep of `segment` that aren't needed for any
+    requested frequency and reports the rest at the requested frequency.
+
+    Parameters
+    ----------
+    segment : sweep_segment
+    data : numpy structured array
+        sweep data with excitation frequencies in data['F']
+
+    Returns
+    -------
+    numpy structured array
+        the needed rows (a copy), with 'F' set to the requested frequencies
+    '''
+    if segment.num_increments == 0:
+        k = np.zeros(len(data), dtype=int)
+    else:
+        k = np.rint((data['F'] - segment.start)/segment.step).astype(int)
+    # position of each row's grid point in segment.points (or -1)
+    lookup = np.full(segment.num_increments+1, -1)
+    lookup[segment.points] = np.arange(len(segment.points))
+    n = lookup[np.clip(k, 0, segment.num_increments)]
+    selected = data[n >= 0]
+    selected['F'] = segment.freqs[n[n >= 0]]
+    return selected
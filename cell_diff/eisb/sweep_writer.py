@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind saving of sweep files.
+
+Writing to the Pi's SD card can take long enough to delay the next sweep, so
+sweep_writer takes finished sweeps (data plus a metadata snapshot) and writes
+them in order on a background thread. The queue is bounded, so a card that
+can't keep up slows acquisition down (or raises) instead of using up memory.
+"""
+import os
+import queue
+import threading
+import time
+import warnings
+
+import sweep_file
+
+FSYNC_POLICIES = ('never', 'each', 'batch')
+
+
+class sweep_writer():
+    '''
+    Background writer for sweep files.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        number of sweeps that can wait to be written (default is 8)
+    fsync : {'never', 'each', 'batch'}, optional
+        'each' syncs every file to the card before the next is written,
+        'batch' syncs the files written so far whenever the queue runs empty,
+        and 'never' leaves it to the OS (default is 'batch')
+    block : bool, optional
+        if the queue is full, submit waits for room (True, the default) or
+        raises queue.Full (False)
+    '''
+    def __init__(self, maxsize=8, fsync='batch', block=True):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('fsync must be one of {}'.format(FSYNC_POLICIES))
+        self.fsync = fsync
+        self.block = block
+        self._queue = queue.Queue(maxsize)
+        self._unsynced = [] # files written since the last batch sync
+        self.errors = [] # (filename, exception) of failed writes
+        self._reported = 0 # errors already warned about
+        self.submitted = 0
+        self.written = 0
+        self.max_depth = 0
+        self.blocked_time = 0.0 # time submit spent waiting for room
+        self._write_time = [0.0, 0.0] # total, max (seconds per file)
+        self._latency = [0.0, 0.0] # total, max (submit to written)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, filename, data, metadata):
+        '''
+        submit(filename, data, metadata)
+
+        Queues `data` to be written to `filename` with `metadata` (see
+        sweep_file.save). `data` is written as is, so it must not be
+        modified afterwards; `metadata` should be a snapshot, e.g.
+        ad5933.file_metadata().
+        '''
+        if not self._thread.is_alive():
+            raise RuntimeError('sweep_writer is closed')
+        item = (filename, data, dict(metadata), time.monotonic())
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if not self.block:
+                raise
+            waiting = time.monotonic()
+            self._queue.put(item)
+            self.blocked_time += time.monotonic() - waiting
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    @property
+    def depth(self):
+        '''number of sweeps waiting to be written'''
+        return self._queue.qsize()
+
+    def flush(self):
+        '''wait until everything submitted so far has been written'''
+        self._queue.join()
+        new = len(self.errors) - self._reported
+        if new:
+            filename, error = self.errors[-1]
+            warnings.warn('{} sweep file(s) could not be written, last: {} '
+                          '({})'.format(new, filename, error))
+            self._reported = len(self.errors)
+
+    def close(self):
+        '''write everything that is queued and stop the writer thread'''
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def stats(self):
+        '''
+        Returns
+        -------
+        dict
+            number of sweeps submitted and written, current and maximum queue
+            depth, mean and maximum time to write a file and from submit to
+            written, total time submit was blocked, and number of errors
+        '''
+        n = max(self.written, 1)
+        return {'submitted':self.submitted, 'written':self.written,
+                'depth':self.depth, 'max_depth':self.max_depth,
+                'write_mean':self._write_time[0]/n,
+                'write_max':self._write_time[1],
+                'latency_mean':self._latency[0]/n,
+                'latency_max':self._latency[1],
+                'blocked_time':self.blocked_time, 'errors':len(self.errors)}
+
+    # -- writer thread -------------------------------------------------------
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    self._sync()
+                    return
+                self._write(*item)
+                if self.fsync == 'batch' and self._queue.empty():
+                    self._sync()
+            finally:
+                self._queue.task_done()
+
+    def _write(self, filename, data, metadata, submitted):
+        started = time.monotonic()
+        try:
+            sweep_file.save(filename, data, metadata)
+            if self.fsync == 'each':
+                _fsync(filename)
+            elif self.fsync == 'batch':
+                self._unsynced.append(filename)
+        except Exception as e: # keep writing the rest, flush reports it
+            self.errors.append((filename, e))
+            return
+        done = time.monotonic()
+        self.written += 1
+        for stat, value in ((self._write_time, done - started),
+                            (self._latency, done - submitted)):
+            stat[0] += value
+            stat[1] = max(stat[1], value)
+
+    def _sync(self):
+        for filename in self._unsynced:
+            try:
+                _fsync(filename)
+            except OSError as e:
+                self.errors.append((filename, e))
+        self._unsynced = []
+
+
+def _fsync(filename):
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
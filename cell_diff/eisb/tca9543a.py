@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Driver for the TCA9543A two channel I2C switch.
+
+The AD5933 has a fixed I2C address, so boards with more than one impedance
+converter put each behind its own channel of the switch and select the
+channel before talking to it.
+"""
+try:
+    import board, busio
+    from adafruit_bus_device import i2c_device
+except ImportError:
+    # not on a Pi: an I2C bus has to be passed in (e.g. i2c_sim.sim_bus)
+    board = busio = None
+    import i2c_sim as i2c_device
+
+
+class tca9543a():
+    '''
+    interface to the TCA9543A I2C switch
+
+    The control register holds one enable bit per channel (B0 for channel 0,
+    B1 for channel 1). The last value written is cached, so selecting the
+    channel that is already selected costs no bus traffic.
+
+    Parameters
+    ----------
+    address : int, optional
+        I2C address set by A0/A1 (default is 0x70)
+    i2c : busio.I2C compatible bus, optional
+        bus the switch is on (default is the Pi's SCL/SDA)
+    '''
+    NUM_CH = 2
+
+    def __init__(self, address=0x70, i2c=None):
+        if i2c is None:
+            if busio is None:
+                raise RuntimeError('No I2C hardware available, pass in a bus '
+                                   '(e.g. i2c_sim.sim_bus) as `i2c`')
+            i2c = busio.I2C(board.SCL, board.SDA)
+        self.i2c = i2c_device.I2CDevice(i2c, address)
+        self._buffer = bytearray(1)
+        self._control = None # unknown until first written
+        self.switches = 0 # number of control register writes
+        self.set_channels(False, False)
+
+    @property
+    def channels(self):
+        '''enabled state of each channel as a tuple of bools'''
+        return tuple(bool(self._control & (1 << ch))
+                     for ch in range(self.NUM_CH))
+
+    @property
+    def selected(self):
+        '''the only enabled channel, or None if none or both are enabled'''
+        enabled = [ch for ch, b in enumerate(self.channels) if b]
+        return enabled[0] if len(enabled) == 1 else None
+
+    def set_channels(self, ch0, ch1):
+        '''enable (True) or disable (False) each channel'''
+        self._write_control(int(bool(ch0)) | int(bool(ch1)) << 1)
+
+    def select(self, ch):
+        '''enable only channel `ch` (None disables both)'''
+        self._write_control(0 if ch is None else 1 << ch)
+
+    def _write_control(self, control):
+        if control == self._control:
+            return
+        self._buffer[0] = control
+        with self.i2c as dev:
+            dev.write(self._buffer)
+        self._control = control
+        self.switches += 1
+
+    def read_control(self):
+        '''control register as read from the switch (including interrupts)'''
+        with self.i2c as dev:
+            dev.readinto(self._buffer)
+        return self._buffer[0]
+
+    def deinit(self):
+        self.set_channels(False, False)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of ad5933 bus usage on a simulated chip, run with pytest in this 
+directory.
+"""
+from ad5933 import ad5933
+from i2c_sim import sim_bus, sim_ad5933, resistor
+
+
+def _sim_ad5933(**kw):
+    bus = sim_bus()
+    bus.attach(ad5933.ADDR, sim_ad5933(resistor(100e3)))
+    return ad5933(i2c=bus, **kw)
+
+
+def _cost(ad, func, *args):
+    before = ad.bus_transactions
+    result = func(*args)
+    return result, ad.bus_transactions - before
+
+
+def test_block_read_reuses_pointer_left_by_byte_wise_access():
+    ad = _sim_ad5933(block_read=True)
+    expected = ad.read_register(0x94, 4).to_bytes(4, 'big')
+    ad.read_register(0x94) # leaves the pointer on 0x94
+    data, cost = _cost(ad, ad.read_block, 0x94, 4)
+    assert (bytes(data), cost) == (expected, 1)
+    ad.write_register(0x82, [0x01, 0x02, 0x03]) # leaves it on 0x84
+    data, cost = _cost(ad, ad.read_block, 0x84, 1)
+    assert (bytes(data), cost) == (b'\x03', 1)
+    ad.read_status() # moves it to 0x8f
+    data, cost = _cost(ad, ad.read_block, 0x94, 4)
+    assert (bytes(data), cost) == (expected, 2)
+
+
+def test_block_read_of_data_in_a_sweep_costs_two_transactions():
+    ad = _sim_ad5933(block_read=True)
+    assert ad.block_read
+    ad.start_freq, ad.freq_step, ad.num_steps = 10e3, 1e3, 3
+    ad.write_sweep_params()
+    costs = []
+    get_data = ad.get_data
+    def counted():
+        data, cost = _cost(ad, get_data)
+        costs.append(cost)
+        return data
+    ad.get_data = counted
+    data = ad.frequency_sweep(repeat=2, verbose=False, init_delay=0)
+    assert len(costs) == len(data) == 2*4
+    # pointer write and block read, the status poll moved the pointer
+    assert costs == [2]*len(costs)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of eis_board sweep files on a simulated bus, run with pytest in this 
+directory.
+"""
+import os.path
+import numpy as np
+
+import sweep_file
+from benchmarks import sim_board
+from eis_reader import read_eis, COLUMNS
+
+
+def _save_sweep(board, name):
+    '''saves one short sweep under `name`, returns the data that was saved'''
+    saved = []
+    save_data = board.save_data
+    board.save_data = lambda data, *args, **kw: (saved.append(data),
+                                                 save_data(data, *args, **kw))
+    try:
+        ad = board.ad
+        ad.start_freq, ad.freq_step, ad.num_steps = 10e3, 1e3, 4
+        ad.write_sweep_params()
+        board.save_freq_sweep(name, progress=[], repeat=2)
+        board.writer.flush()
+    finally:
+        board.close()
+    return saved[0]
+
+
+def test_default_save_round_trips_through_text_reader(tmpdir):
+    board, bus = sim_board(latency=0)
+    data = _save_sweep(board, os.path.join(str(tmpdir), 'sweep'))
+    assert os.listdir(str(tmpdir)) == ['sweep_ch0_0.txt']
+    filename = os.path.join(str(tmpdir), 'sweep_ch0_0.txt')
+    assert not sweep_file.is_sweep_file(filename)
+    metadata, rows = read_eis(filename)
+    assert metadata['pga_gain'] == str(board.ad.pga_gain)
+    assert len(rows) == len(data) == 2*5
+    for i, name in enumerate(COLUMNS):
+        assert np.allclose(rows[:,i], data[name])
+    
+
+def test_binary_save_is_opt_in(tmpdir):
+    board, bus = sim_board(latency=0)
+    board.close()
+    board = type(board)(ad_kw={'i2c':bus}, binary=True)
+    _save_sweep(board, os.path.join(str(tmpdir), 'sweep'))
+    assert os.listdir(str(tmpdir)) == ['sweep_ch0_0'+sweep_file.EXTENSION]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of i2c_trace register attribution, run with pytest in this directory.
+"""
+from ad5933 import ad5933
+from i2c_sim import sim_bus, sim_ad5933, resistor
+from i2c_trace import traced_bus
+
+
+def _traced_ad5933():
+    bus = sim_bus()
+    bus.attach(ad5933.ADDR, sim_ad5933(resistor(100e3)))
+    traced = traced_bus(bus)
+    return ad5933(i2c=traced), traced
+
+
+def test_block_read_counts_against_pointer_register():
+    ad, traced = _traced_ad5933()
+    traced.reset()
+    ad.read_block(0x92, 6)
+    ad.read_block(0x92, 6) # pointer reused, block command only
+    registers = traced.stats()['devices'][ad5933.ADDR]['registers']
+    assert set(registers) == {0x92}
+    assert registers[0x92]['count'] == 3
+    assert all(0x92 <= r <= 0x97 for _, r in traced.registers)
+
+
+def test_block_read_keeps_pointer_across_reset():
+    ad, traced = _traced_ad5933()
+    ad.read_block(0x94, 4)
+    traced.reset()
+    ad.read_block(0x94, 4)
+    traced.readfrom_into(ad5933.ADDR, bytearray(1))
+    assert set(traced.registers) == {(ad5933.ADDR, 0x94)}
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the pi_gpio clock divider pins (simulated off the Pi), run with 
+pytest in this directory.
+"""
+from pi_gpio import pi_gpio, calc_clock_divide
+
+
+def _clk_pins(rpi):
+    d0, d1 = [[rpi._pin_values[i+k] for i in range(4)] for k in (9, 5)]
+    return d0, d1
+
+
+def test_mode_change_at_same_divider_rewrites_pins():
+    rpi = pi_gpio()
+    try:
+        assert rpi.set_clock_divide(8, mode=2)
+        assert _clk_pins(rpi) == tuple(list(map(bool, d)) 
+                                       for d in calc_clock_divide(8, 2))
+        writes = rpi.pin_writes
+        assert not rpi.set_clock_divide(8, mode=2)
+        assert rpi.pin_writes == writes
+        # 8/4 = 2 instead of 8/2 = 4: bit 1 set, bit 2 cleared
+        assert rpi.set_clock_divide(8, mode=4)
+        assert rpi.pin_writes == writes + 2
+        assert _clk_pins(rpi) == tuple(list(map(bool, d)) 
+                                       for d in calc_clock_divide(8, 4))
+        assert (rpi.divider, rpi.divider_mode) == (8, 4)
+    finally:
+        rpi.cleanup_GPIO()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of sweep_planner segment sizes, run with pytest in this directory.
+"""
+import math
+import numpy as np
+
+from sweep_planner import plan_segments
+
+LOG_FREQS = np.round(np.logspace(3, 5, 10))
+
+
+def _conversions(f, divider):
+    return 100/f + 1024*16*divider/16e6
+
+
+def test_linear_request_is_one_segment_without_extra_increments():
+    freqs = np.arange(10e3, 100e3, 1e3)
+    segments = plan_segments(freqs)
+    assert len(segments) == 1
+    assert segments[0].num_increments == len(freqs) - 1
+
+
+def test_grid_increments_are_capped_per_requested_frequency():
+    segments = plan_segments(LOG_FREQS, point_time=_conversions,
+                             point_overhead=6*0.39e-3)
+    for seg in segments:
+        assert seg.num_increments <= max(len(seg.freqs)-1, 4*len(seg.freqs))
+    assert sum(seg.num_increments+1 for seg in segments) <= 4*len(LOG_FREQS)
+    swept = np.concatenate([seg.start + seg.step*seg.points 
+                            for seg in segments])
+    assert np.all(np.abs(swept - LOG_FREQS)/LOG_FREQS <= 0.01)
+
+
+def test_uncapped_plan_uses_a_dense_grid():
+    # what the cap prevents: one long grid keeping few of its points
+    segments = plan_segments(LOG_FREQS, point_time=_conversions,
+                             max_grid_ratio=math.inf)
+    assert max(seg.num_increments for seg in segments) > 4*len(LOG_FREQS)
+
+
+def test_point_overhead_favours_fewer_increments():
+    freqs = np.round(np.logspace(4, 5, 20))
+    increments = [sum(seg.num_increments+1 for seg in plan_segments(
+                      freqs, point_time=_conversions, point_overhead=overhead,
+                      max_grid_ratio=math.inf))
+                  for overhead in (0.0, 0.05)]
+    assert increments[1] < increments[0]
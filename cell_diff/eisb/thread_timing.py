@@ -3,22 +3,33 @@
 Created on Thu Jul 11 11:06:43 2019
 
 @author: joeld
+
+Periodic execution on monotonic deadlines.
+
+periodic_scheduler calls a function at start + k*interval on the calling
+thread, sleeping on an Event (or on select for stdin) between calls, so the
+period doesn't drift with the execution time and nothing polls while idle.
 """
 
-from threading import Thread
-from queue import Queue
+import math
+import os
+import select
+import sys
+import threading
 import time
 import datetime
 
-def timed_execution(func, interval, *func_args, num_intervals=None, 
-                    **func_kwargs):
+OVERRUN_POLICIES = ('skip', 'catch_up', 'shift')
+
+def timed_execution(func, interval, *func_args, num_intervals=None,
+                    overrun='skip', stop=None, **func_kwargs):
     '''
     Executes a function at periodic intervals.
-    
+
     Parameters
     ----------
     func : callable
-        `func` will be called every `interval` seconds and passed the 
+        `func` will be called every `interval` seconds and passed the
         `func_args` and `func_kwargs` parameters.
     interval : float
         The number of seconds between calls to `func`.
@@ -27,150 +38,216 @@ def timed_execution(func, interval, *func_args, num_intervals=None,
     num_intervals : int, optional
         The number of executions of `func`. Default is None, in which case the
         loop will continue indefinitely until the user enter "q" in stdin.
-    
-    Notes
-    -----
-    In testing, timing seems accurate to hundredths of seconds
-    '''
-    if num_intervals is not None and num_intervals < 1:
-        raise ValueError('max_intervals must be a positive integer')
-    q = Queue()
-    threads = []
-    threads.append( Thread(target=timing_thread, args=(q, interval), 
-                kwargs={'max_intervals':num_intervals}) )
-    threads.append( Thread(target=execute_thread, args=(q, func)+func_args,
-                kwargs=func_kwargs) )
-    if num_intervals is None:
-        threads.append( Thread(target=wait_for_interrupt, args=(q,)) )
-    
-    for t in threads:
-        t.start()
-    
-    q.join()
-    for t in threads:
-        t.join()
-
-def timing_thread(q, interval, max_intervals=None):
-    '''
-    Adds an "execute" command to the queue at fixed time intervals.
-        
-    Adds "execute" to queue every `interval` seconds or until `max_intervals` 
-    if specified.
-    
-    Parameters
-    ----------
-    q : queue.Queue object
-        A queue.Queue object will share control signals between threads
-    interval : float
-        The number of seconds to wait between executes.
-    max_intervals : int, optional
-        The maximum number of executions to schedule (default is None in which
-        case the thread will run indefinitely until a 'quit' signal is on the 
-        queue)
-        
+    overrun : {'skip', 'catch_up', 'shift'}, optional
+        What to do when `func` runs past the next deadline (see
+        periodic_scheduler, default is 'skip').
+    stop : threading.Event, optional
+        Setting this event (e.g. from another thread) stops the loop.
+
+    Returns
+    -------
+    dict
+        timing statistics, see periodic_scheduler.stats
+
     Notes
     -----
-    If the function called in response to 'execute' commands takes longer to 
-    complete than `interval`, the timing will not be preserved.
+    Deadlines are kept on time.monotonic(), so timing doesn't drift with the
+    execution time of `func` as long as it finishes within `interval`.
     '''
-    i = 0
-    while True:
-        if not q.empty():
-            task = q.get()
-            q.task_done()
-            if task == 'quit':
-                q.put('quit')
-                break
-        
-        if max_intervals is not None:
-            if i >= max_intervals:
-                q.put('quit')
-                break
-        
-        q.put('execute')
-        i += 1
-        time.sleep(interval)
-
-def execute_thread(q, func, *args, sleep_interval=0.001, **kwargs):
+    scheduler = periodic_scheduler(func, interval, *func_args,
+                                   num_intervals=num_intervals,
+                                   overrun=overrun, stop=stop,
+                                   watch_stdin=num_intervals is None,
+                                   **func_kwargs)
+    scheduler.run()
+    return scheduler.stats()
+
+class periodic_scheduler():
     '''
-    Executes a function when signalled by the queue.
-    
-    In a loop, checks the queue for the 'execute' signal. On detection, calls 
-    `func` and passes in `args` and `kwargs`.
-    
+    Calls `func(*func_args, **func_kwargs)` every `interval` seconds on the
+    thread that calls run.
+
     Parameters
     ----------
-    q : queue.Queue object
-        A queue.Queue object will to share control signals between threads.
     func : callable
-        `func` will be executed on detection of 'execute' signal in `q`.
-    args : iterable, optional
-        A list of arguments to be passed into `func`.
-    sleep_interval : float, optional
-        Seconds to wait between loop iterations (the default is 0.001s).
-    kwargs : dict, optional
-        Keyword argument dict to be passed into `func`.
-    '''
-    while True:
-        if not q.empty():
-            task = q.get()
-            q.task_done()
-            if task == 'quit':
-                q.put('quit')
-                break
-            elif task == 'execute':
-                func(*args, **kwargs)
-        time.sleep(sleep_interval)
-       
-def wait_for_interrupt(q, sleep_interval=0.001):
-    '''
-    Loop that waits for the input "q" and then adds a "quit" signal to queue.
-    
-    Parameters
-    ----------
-    q : queue.Queue object
-        A queue.Queue object will to share control signals between threads.
-    sleep_interval : float, optional
-        Seconds to wait between loop iterations (the default is 0.001s).
+    interval : float
+        seconds between deadlines
+    num_intervals : int, optional
+        number of calls before run returns (default is None, unlimited)
+    overrun : {'skip', 'catch_up', 'shift'}, optional
+        when a call ends after the next deadline, 'skip' drops the missed
+        deadlines and waits for the next one on the original grid,
+        'catch_up' makes the missed calls back-to-back, and 'shift' calls
+        immediately and moves the grid to start from that call (default is
+        'skip')
+    stop : threading.Event, optional
+        event that stops the loop when set (default is a new event, see the
+        stop method)
+    watch_stdin : bool, optional
+        stop when "q" is entered on stdin (default is False)
     '''
-    print('enter "q" to exit',end='')
-    while True:
-        if not q.empty():
-            task = q.get()
-            q.task_done()
-            if task == 'quit':
-                q.put('quit')
-                break
-        x = input("")
-        if x == 'q':
-            q.put('quit')
-            break
-        time.sleep(sleep_interval)
-        
+    def __init__(self, func, interval, *func_args, num_intervals=None,
+                 overrun='skip', stop=None, watch_stdin=False, **func_kwargs):
+        if num_intervals is not None and num_intervals < 1:
+            raise ValueError('num_intervals must be a positive integer')
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError('overrun must be one of {}'.format(
+                    OVERRUN_POLICIES))
+        self.func = func
+        self.interval = interval
+        self.func_args = func_args
+        self.func_kwargs = func_kwargs
+        self.num_intervals = num_intervals
+        self.overrun = overrun
+        # an event set by someone else can't interrupt select, so stdin is
+        # then only watched in short slices
+        self._external_stop = stop is not None
+        self._stop = threading.Event() if stop is None else stop
+        self.watch_stdin = watch_stdin
+        self._stdin = None
+        self._wake = None # pipe used to interrupt select
+
+        self.ticks = 0 # calls made
+        self.overruns = 0 # calls that ended after the next deadline
+        self.skipped = 0 # deadlines dropped by the 'skip' policy
+        # running sums for the lateness (jitter) and duration of the calls
+        self._jitter = [0.0, 0.0, 0.0] # mean, sum of squared deviations, max
+        self._runtime = [0.0, 0.0] # mean, max
+
+    def stop(self):
+        '''stop the loop (safe to call from any thread)'''
+        self._stop.set()
+        try:
+            os.write(self._wake[1], b'q')
+        except (TypeError, OSError): # not watching stdin (anymore)
+            pass
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def run(self):
+        '''run until stopped or num_intervals calls have been made'''
+        self._watch_stdin()
+        try:
+            deadline = time.monotonic()
+            while not self.stopped:
+                if self.num_intervals is not None \
+                        and self.ticks >= self.num_intervals:
+                    break
+                if not self._sleep_until(deadline):
+                    break
+                started = time.monotonic()
+                self.func(*self.func_args, **self.func_kwargs)
+                ended = time.monotonic()
+                self._record(started - deadline, ended - started)
+                deadline = self._next_deadline(deadline, ended)
+        finally:
+            self._unwatch_stdin()
+
+    def _record(self, late, runtime):
+        self.ticks += 1
+        jitter, duration = self._jitter, self._runtime
+        delta = late - jitter[0]
+        jitter[0] += delta/self.ticks
+        jitter[1] += delta*(late - jitter[0])
+        jitter[2] = max(jitter[2], late)
+        duration[0] += (runtime - duration[0])/self.ticks
+        duration[1] = max(duration[1], runtime)
+
+    def _next_deadline(self, deadline, now):
+        deadline += self.interval
+        if now <= deadline:
+            return deadline
+        self.overruns += 1
+        if self.overrun == 'skip':
+            missed = math.ceil((now - deadline)/self.interval)
+            self.skipped += missed
+            return deadline + missed*self.interval
+        if self.overrun == 'shift':
+            return now
+        return deadline # catch_up
+
+    def _sleep_until(self, deadline):
+        '''wait for `deadline`, returns False if stopped first'''
+        while not self.stopped:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return True
+            if self._stdin is None:
+                self._stop.wait(timeout)
+                continue
+            if self._external_stop:
+                timeout = min(timeout, 0.5)
+            ready = select.select([self._stdin, self._wake[0]], [], [],
+                                  timeout)[0]
+            if self._stdin in ready:
+                line = self._stdin.readline()
+                if line.strip() == 'q':
+                    self.stop()
+                elif not line: # EOF, nobody can type "q" anymore
+                    self._unwatch_stdin()
+        return False
+
+    def _watch_stdin(self):
+        if not self.watch_stdin:
+            return
+        print('enter "q" to exit')
+        try:
+            # select works on stdin everywhere but Windows
+            if sys.platform.startswith('win'):
+                raise OSError('stdin is not selectable')
+            select.select([sys.stdin], [], [], 0)
+            self._stdin = sys.stdin
+            self._wake = os.pipe()
+        except (OSError, ValueError, AttributeError):
+            # a thread blocked on input() doesn't poll either, but it can't be
+            # cancelled, so it is only used where select doesn't work
+            threading.Thread(target=self._wait_for_q, daemon=True).start()
+
+    def _unwatch_stdin(self):
+        self._stdin = None
+        if self._wake is not None:
+            for fd in self._wake:
+                os.close(fd)
+            self._wake = None
+
+    def _wait_for_q(self):
+        while not self.stopped:
+            try:
+                x = input("")
+            except EOFError:
+                return
+            if x == 'q':
+                self.stop()
+
+    def stats(self):
+        '''
+        Summarizes the timing of the calls made so far.
+
+        Returns
+        -------
+        dict
+            number of calls, overruns, and skipped deadlines, and the mean,
+            standard deviation, and maximum lateness (jitter) and mean and
+            maximum duration of the calls, in seconds
+        '''
+        if self.ticks == 0:
+            return {'ticks':0, 'overruns':0, 'skipped':0}
+        return {'ticks':self.ticks, 'overruns':self.overruns,
+                'skipped':self.skipped, 'jitter_mean':self._jitter[0],
+                'jitter_std':math.sqrt(self._jitter[1]/self.ticks),
+                'jitter_max':self._jitter[2],
+                'runtime_mean':self._runtime[0], 
+                'runtime_max':self._runtime[1]}
 
 
 def test_func(x):
     x.append(str(datetime.datetime.now()))
 
 if __name__ == '__main__':
-
-#    q = Queue()
-#    
-#    result = [] # must be mutable!!! 
-#    t1 = Thread(target=timing_thread, args=(q,2), )#kwargs={'max_intervals':5})
-#    t2 = Thread(target=execute_thread, args=(q, test_func, result))
-#    t3 = Thread(target=wait_for_interrupt, args=(q,))
-#    t1.start()
-#    t2.start()
-#    t3.start()
-#    
-#    q.join()
-#    
-#    t1.join()
-#    t2.join()
-#    t3.join()
     result=[]
-    timed_execution(test_func, 1.0, result, max_intervals=10)
+    print(timed_execution(test_func, 1.0, result, num_intervals=10))
+    print(result)
+    print(timed_execution(test_func, 1.0, result))
     print(result)
-    timed_execution(test_func, 1.0, result)
-    print(result)
\ No newline at end of file
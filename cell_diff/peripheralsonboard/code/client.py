@@ -225,8 +225,8 @@ class Client:
         self.client.send('get_values*'.encode())
         message = self.client.recv(4096).decode() 
         
-        # f represents frequency          
-        temp, f, x, y = message.split(',')
+        # f represents frequency, a calibrated server also sends |Z| and phase          
+        temp, f, x, y, *calibrated = message.split(',')
         
         # sets variables for current values and append to list of all values
         self.x = float(x)
@@ -240,12 +240,17 @@ class Client:
         self.current_temp = temp
         self.all_temps.append(float(temp))
         
-        # calculates R and appends value
-        self.current_R = math.sqrt(self.x ** 2 + self.y ** 2)
+        # calculates R and appends value (|Z| in ohms if calibrated)
+        if calibrated:
+            self.current_R = float(calibrated[0])
+        else:
+            self.current_R = math.sqrt(self.x ** 2 + self.y ** 2)
         self.all_R.append(float(self.current_R))
         
         # calculated theta and appends value
-        if self.y != 0 and self.x != 0: # makes sure you do not divide by 0
+        if calibrated:
+            self.current_theta = float(calibrated[1])
+        elif self.y != 0 and self.x != 0: # makes sure you do not divide by 0
             self.current_theta = math.atan(self.y/self.x)
         else:
             self.current_theta = 0
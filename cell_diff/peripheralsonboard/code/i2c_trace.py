@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Transaction tracing for busio.I2C compatible buses.
+
+traced_bus wraps a bus object (busio.I2C, i2c_sim.sim_bus, ...) and can be
+passed anywhere the bus itself is used, e.g. ad5933(i2c=traced_bus(i2c)) or
+MCP23017(traced_bus(i2c)). Every transaction is counted per device and
+register with its bytes and duration, and optionally appended to a binary
+trace file. Tracing is opt-in: code that isn't given a traced_bus talks to
+the bus directly and pays nothing.
+
+The register of a transaction is the first byte written to the device
+(the register pointer of the MCP23017 and MCP9600). A read without a write
+is counted against the register last written. For the AD5933, pointer
+commands (0xB0) count against the register they point to, and block reads
+and writes (0xA1, 0xA0) against the current pointer register.
+
+Trace file layout (little-endian)
+---------------------------------
+    16 byte header: 4s magic b'I2CT', H version, H record size, 8 zero bytes
+    records of TRACE_DTYPE: start time (s since the first transaction),
+    duration (s), address, register (-1 if unknown), operation (see OPS),
+    bytes written, bytes read, error (1 if the transaction raised)
+"""
+import bisect
+import struct
+import time
+import numpy as np
+
+MAGIC = b'I2CT'
+VERSION = 1
+_HEADER = struct.Struct('<4sHH8x')
+TRACE_DTYPE = np.dtype([('t', '<f8'), ('dt', '<f4'), ('address', 'u1'),
+                        ('register', '<i2'), ('op', 'u1'), ('out', '<u2'),
+                        ('in', '<u2'), ('error', 'u1')])
+OPS = ('write', 'read', 'write_read')
+# first bytes that set a register pointer to the byte that follows
+POINTER_COMMANDS = (0xB0,)
+# first bytes of block transfers from the register pointer, which they leave
+# unchanged
+BLOCK_COMMANDS = (0xA0, 0xA1)
+# upper edges of the latency histogram bins (s), 10 us to 100 ms with four
+# bins per decade, the last bin is everything slower
+LATENCY_BINS = tuple(10**(e/4) for e in range(-20, -3))
+
+
+class _counter():
+    '''transactions, bytes, time and latency histogram of one register'''
+    __slots__ = ('count', 'bytes', 'busy', 'max', 'errors', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.histogram = [0]*(len(LATENCY_BINS)+1)
+
+    def add(self, nbytes, dt, error):
+        self.count += 1
+        self.bytes += nbytes
+        self.busy += dt
+        self.max = max(self.max, dt)
+        self.errors += error
+        self.histogram[bisect.bisect_left(LATENCY_BINS, dt)] += 1
+
+    def summary(self):
+        return {'count':self.count, 'bytes':self.bytes, 'busy':self.busy,
+                'latency_mean':self.busy/max(self.count, 1),
+                'latency_max':self.max, 'errors':self.errors,
+                'histogram':list(self.histogram)}
+
+
+class traced_bus():
+    '''
+    busio.I2C compatible wrapper that records every transaction on `bus`.
+
+    Parameters
+    ----------
+    bus : busio.I2C compatible bus
+    trace_file : str, optional
+        binary file the transactions are appended to (see module docstring
+        and read_trace), default is no file
+    enabled : bool, optional
+        record transactions (default is True), see the enabled attribute
+
+    Transactions happen while the bus is locked (try_lock), so the counters
+    are only updated by one thread at a time.
+    '''
+    def __init__(self, bus, trace_file=None, enabled=True):
+        self.bus = bus
+        self.enabled = enabled
+        self._file = None
+        if trace_file is not None:
+            self._file = open(trace_file, 'wb')
+            self._file.write(_HEADER.pack(MAGIC, VERSION,
+                                          TRACE_DTYPE.itemsize))
+        self._record = np.zeros(1, TRACE_DTYPE)
+        # last register written per address, kept by reset since it is the
+        # devices' state (the AD5933 driver reuses its pointer)
+        self._pointer = {}
+        self.reset()
+
+    def reset(self):
+        '''clear the counters and restart the utilisation clock'''
+        self.registers = {} # {(address, register): _counter}
+        self.started = time.monotonic()
+        self.busy = 0.0
+        self.transactions = 0
+        self.errors = 0
+
+    # -- busio.I2C interface -------------------------------------------------
+    def __getattr__(self, name):
+        # frequency, scan, deinit, ... of the wrapped bus
+        return getattr(self.bus, name)
+
+    def try_lock(self):
+        return self.bus.try_lock()
+
+    def unlock(self):
+        self.bus.unlock()
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        if not self.enabled:
+            return self.bus.writeto(address, buffer, start=start, end=end)
+        out = len(buffer) if end is None else end
+        with self._trace(address, 0, buffer, start, out-start, 0):
+            self.bus.writeto(address, buffer, start=start, end=end)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        if not self.enabled:
+            return self.bus.readfrom_into(address, buffer, start=start,
+                                          end=end)
+        n = (len(buffer) if end is None else end) - start
+        with self._trace(address, 1, None, 0, 0, n):
+            self.bus.readfrom_into(address, buffer, start=start, end=end)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0,
+                              in_end=None):
+        if not self.enabled:
+            return self.bus.writeto_then_readfrom(
+                    address, buffer_out, buffer_in, out_start=out_start,
+                    out_end=out_end, in_start=in_start, in_end=in_end)
+        n_out = (len(buffer_out) if out_end is None else out_end) - out_start
+        n_in = (len(buffer_in) if in_end is None else in_end) - in_start
+        with self._trace(address, 2, buffer_out, out_start, n_out, n_in):
+            self.bus.writeto_then_readfrom(
+                    address, buffer_out, buffer_in, out_start=out_start,
+                    out_end=out_end, in_start=in_start, in_end=in_end)
+
+    def deinit(self):
+        self.close()
+        self.bus.deinit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+
+    # -- recording -----------------------------------------------------------
+    def _trace(self, address, op, buffer, start, n_out, n_in):
+        if n_out and buffer[start] in BLOCK_COMMANDS:
+            register = self._pointer.get(address, -1)
+        elif n_out:
+            register = buffer[start]
+            if register in POINTER_COMMANDS and n_out > 1:
+                register = buffer[start+1]
+            self._pointer[address] = register
+        else:
+            register = self._pointer.get(address, -1)
+        return _transaction(self, address, register, op, n_out, n_in)
+
+    def _add(self, address, register, op, n_out, n_in, t0, dt, error):
+        key = (address, register)
+        counter = self.registers.get(key)
+        if counter is None:
+            counter = self.registers[key] = _counter()
+        counter.add(n_out+n_in, dt, error)
+        self.busy += dt
+        self.transactions += 1
+        self.errors += error
+        if self._file is not None:
+            self._record[0] = (t0-self.started, dt, address, register, op,
+                               n_out, n_in, error)
+            self._file.write(self._record.tobytes())
+
+    def flush(self):
+        '''write buffered trace records to the trace file'''
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        '''close the trace file (counting continues)'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # -- results -------------------------------------------------------------
+    @property
+    def utilisation(self):
+        '''fraction of the time since reset spent in traced transactions'''
+        elapsed = time.monotonic() - self.started
+        return self.busy/elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        '''
+        Returns
+        -------
+        dict
+            elapsed and busy time (s), utilisation, transactions and errors
+            for the whole bus, and per device address the same counters
+            plus per register: count, bytes, busy, latency_mean, latency_max,
+            errors and a latency histogram over LATENCY_BINS
+        '''
+        devices = {}
+        for (address, register), counter in sorted(self.registers.items()):
+            device = devices.setdefault(address, {'count':0, 'bytes':0,
+                                                  'busy':0.0, 'errors':0,
+                                                  'registers':{}})
+            summary = counter.summary()
+            for key in ('count', 'bytes', 'busy', 'errors'):
+                device[key] += summary[key]
+            device['registers'][register] = summary
+        elapsed = time.monotonic() - self.started
+        return {'elapsed':elapsed, 'busy':self.busy,
+                'utilisation':self.busy/elapsed if elapsed > 0 else 0.0,
+                'transactions':self.transactions, 'errors':self.errors,
+                'latency_bins':list(LATENCY_BINS), 'devices':devices}
+
+    def report(self, top=10):
+        '''print the `top` registers by bus time'''
+        stats = self.stats()
+        print('{} transactions, {:.1%} bus utilisation over {:.1f} s'.format(
+                stats['transactions'], stats['utilisation'],
+                stats['elapsed']))
+        print('address register    count    bytes  busy (s)  mean (ms)')
+        ranked = sorted(self.registers.items(), key=lambda kv: -kv[1].busy)
+        for (address, register), counter in ranked[:top]:
+            print('   0x{:02x}     {:>4} {:8d} {:8d} {:9.3f} {:10.3f}'.format(
+                    address, 'n/a' if register < 0 else '0x{:02x}'.format(
+                        register), counter.count, counter.bytes,
+                    counter.busy, 1e3*counter.busy/counter.count))
+
+
+class _transaction():
+    '''times one transaction, counted even if it raises'''
+    __slots__ = ('bus', 'args', 't0')
+
+    def __init__(self, bus, *args):
+        self.bus = bus
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.monotonic()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        t1 = time.monotonic()
+        self.bus._add(*self.args, self.t0, t1-self.t0, exc_type is not None)
+
+
+def read_trace(filename):
+    '''
+    Returns
+    -------
+    numpy.ndarray
+        the TRACE_DTYPE records of a trace file
+    '''
+    with open(filename, 'rb') as f:
+        magic, version, size = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not an I2C trace file'.format(filename))
+        if size != TRACE_DTYPE.itemsize:
+            raise ValueError('unsupported trace record size {}'.format(size))
+        return np.fromfile(f, TRACE_DTYPE)
@@ -14,9 +14,19 @@ def thermocouple_connect(i2c, address=0x60):
     # defaults to "K" type thermocouple type
     return adafruit_mcp9600.MCP9600(i2c, address=address)
 
-def i2c_connect(freq=10000):
-    # establish an I2C connection, reduce speed for reliability
-    return busio.I2C(board.SCL, board.SDA, frequency=freq)
+def i2c_connect(freq=None, trace=None, default_freq=10000):
+    # establish an I2C connection at the clock found by i2c_tune for this
+    # board, or else at a reduced speed for reliability
+    if freq is None:
+        from i2c_tune import tuned_frequency
+        freq = tuned_frequency(default=default_freq)
+    i2c = busio.I2C(board.SCL, board.SDA, frequency=freq)
+    if trace is None:
+        return i2c
+    # opt-in transaction tracing, trace=True counts transactions (see 
+    # i2c_trace.traced_bus.stats), a filename also writes a trace file
+    from i2c_trace import traced_bus
+    return traced_bus(i2c, trace_file=None if trace is True else trace)
     
 def mcp_connect(i2c, address= 0):
     #connect to MCP23018, 0x20 is the default address when address pin is grounded
@@ -38,16 +48,31 @@ class LoS():
     EN_PINS = (1,3,5,7,9,11,13,15)
     ST_PINS = (0,2,4,6,8,10,12,14)
     PULSE_TIME = 0.05 # seconds, max activation time of LHL valves is 30ms
+    # seconds a thermocouple reading is shared between threads on a shared 
+    # bus (the MCP9600 updates about every 80 ms)
+    TEMP_COALESCE = 0.05
     
     # in board v2.0 these valve indices are wired incorrectly
     BROKEN_VALVES = (1,2,4,6)
     
     
-    def __init__(self, i2c_freq=100000, mcp_addr=0x20, tc_addr=0x60):
-        self.i2c = i2c_connect(freq=i2c_freq)
-        self.mcp = mcp_connect(self.i2c, address=mcp_addr) 
+    def __init__(self, i2c_freq=None, mcp_addr=0x20, tc_addr=0x60,
+                 i2c_trace=None, bus=None):
+        if bus is None:
+            # i2c_freq defaults to the tuned clock (see i2c_tune), or 100 kHz
+            self.i2c = i2c_connect(freq=i2c_freq, trace=i2c_trace, 
+                                   default_freq=100000)
+            valve_i2c = tc_i2c = self.i2c
+        else:
+            # shared with other drivers (e.g. the ad5933), see 
+            # i2c_bus.bus_manager: temperature reads (from the PID thread 
+            # and the server) go before valve writes
+            self.i2c = bus
+            valve_i2c = bus.client('valve')
+            tc_i2c = bus.client('safety', coalesce=self.TEMP_COALESCE)
+        self.mcp = mcp_connect(valve_i2c, address=mcp_addr) 
         self.init_valves()
-        self.tc = thermocouple_connect(self.i2c, address=tc_addr)
+        self.tc = thermocouple_connect(tc_i2c, address=tc_addr)
         self.heat = self.init_heat()
         self.heater_thread = None
         self.pid_thread = None
@@ -10,7 +10,7 @@ Created on Tue May 30 14:37:22 2023
 @author: EVOS
 """
 
-from labonscope import LoS
+from labonscope import LoS, i2c_connect
 # from eis_board import eis_board
 import socket
 import time
@@ -22,12 +22,29 @@ import sys
 sys.path.append(os.path.expanduser('~/Documents/Python/eisb'))
 
 from ad5933 import ad5933
+from calibration import calibration_table
+from i2c_bus import bus_manager
     
 class LoSServer():
         
-    def __init__(self, *args, **kwargs):
-        self.los = LoS(*args, **kwargs)
-        self.ad = ad5933()
+    def __init__(self, *args, ad_kw={}, cal_file=None, **kwargs):
+        # ad_kw is passed to every ad5933, e.g. {'i2c': i2c_sim.sim_bus()}
+        self.ad_kw = dict(ad_kw)
+        self.bus = kwargs.pop('bus', None)
+        if self.bus is None and 'i2c' not in self.ad_kw:
+            # the LoS peripherals and the ad5933 share the pins, so one 
+            # manager owns the bus and arbitrates between them
+            self.bus = bus_manager(i2c_connect(
+                    freq=kwargs.pop('i2c_freq', None),
+                    trace=kwargs.pop('i2c_trace', None), default_freq=100000))
+        if self.bus is not None:
+            self.ad_kw.setdefault('i2c', self.bus.client('sweep'))
+        self.los = LoS(*args, bus=self.bus, **kwargs)
+        # with a calibration sweep (or saved table) the values reply also 
+        # carries calibrated |Z| and phase
+        if cal_file is not None:
+            self.ad_kw['calibration'] = calibration_table.from_file(cal_file)
+        self.ad = ad5933(**self.ad_kw)
         
     def run(self, ip, port=8080):
         
@@ -38,7 +55,10 @@ class LoSServer():
                    
             # sends temp to client
             def values():
-                conn.sendall((str(self.los.get_temperature()) + "," + str(self.ad.curr_f) + ',' + str(self.ad.curr_r) + ',' + str(self.ad.curr_i)).encode())
+                message = str(self.los.get_temperature()) + "," + str(self.ad.curr_f) + ',' + str(self.ad.curr_r) + ',' + str(self.ad.curr_i)
+                if self.ad.calibration is not None:
+                    message += ',' + str(self.ad.curr_m) + ',' + str(self.ad.curr_p)
+                conn.sendall(message.encode())
                                         
             # sets valves to input
             def valves():
@@ -87,17 +107,15 @@ class LoSServer():
                         self.ad.start_freq = float(message)
                         self.ad._write_start_freq()    
             
-            # start frequency sweep
+            # start frequency sweep (with any start value or single 
+            # frequency set since the last stop)
             def start_freq_t():
-                self.ad = ad5933()
-                self.ad.thread_bool = True
                 self.ad.start_thread()
                 
-            # stops frequency sweep
+            # stops frequency sweep and returns the driver to its initial
+            # configuration, only rewriting registers that changed
             def stop_freq_thread():
-                self.ad.thread_bool = False
-                self.ad = None
-                self.ad = ad5933()
+                self.ad.soft_reset()
             
             # starts single frequency mode
             def single_freq_mode():